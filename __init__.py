@@ -11,11 +11,28 @@ from core.hash import password_hash, password_check
 from core.decorators import *
 from core.validation import *
 #from core.sendmail import Mail
-from extensions.flask_compress import Compress
+from extensions.flask_compress import Compress, LRUCache
+from extensions.precompress import PrecompressedStatic
+from extensions.template_cache import TemplateCache
+from extensions.conditional import ConditionalResponses
+from extensions.assets import AssetManifest
+from extensions.bundles import Bundler
 #from extensions.html2text import *
 
 app = Flask(__name__)
+app.config['COMPRESS_CACHE_BACKEND'] = LRUCache
+app.config['COMPRESS_ADAPTIVE'] = True
 Compress(app)
+ConditionalResponses(app) #Must be after Compress
+PrecompressedStatic(app)
+app.config['ASSETS_RELOAD'] = not PRODUCTION_SERVER
+app.config['ASSET_BUNDLES'] = {
+    'layout.css': ['style.css'],
+    'layout.js': ['elasticize.js'],
+}
+Bundler(app)
+AssetManifest(app) #Must be after PrecompressedStatic and Bundler
+TemplateCache(app)
 mysql = DatabaseConnection(DATABASE_HOST, DATABASE_NAME, DATABASE_USER, DATABASE_PASSWORD)
 
 #Functions below are just for testing different features and are a mess
@@ -27,12 +44,14 @@ def image_jpg(id):
 def image_png(id):
     return send_from_directory('static', '{}.png'.format(id))
     
+email_opens = tracking.EmailOpenBuffer(lambda: DatabaseConnection(DATABASE_HOST, DATABASE_NAME, DATABASE_USER, DATABASE_PASSWORD).sql)
+
 @app.route('/tracking/email/<string:id>.gif')
-@set_content_type('image/gif')
 def email_tracking(id):
-    #write id to database
-    #call it like this in the email - <img src="url_for('email_tracking', id='xxx')" style="display:none">
-    return 'data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7'
+    #call it like this in the email - <img src="url_for('email_tracking', id=tracking_id, _external=True)" width="1" height="1">
+    if len(id) <= 64:
+        email_opens.add(id)
+    return tracking.tracking_pixel()
     
 
 @app.route('/wipe_server')
@@ -99,13 +118,13 @@ def email_template_edit(session, template_id):
     
 @app.route('/email/edit/', methods=['GET', 'POST'])
 @session_start(mysql)
-@set_template('email_template_list.html')
+@set_template('email_template_list.html', stream=True)
 def email_template_list(session):
     pass
 
 @app.route('/')
 @session_start(mysql)
-@set_template('index.html')
+@set_template('index.html', cache_ttl=PAGE_CACHE_TTL)
 def index(session):
 
     try:
@@ -147,7 +166,7 @@ def register(session):
 @app.route('/login', methods=['GET', 'POST'])
 @session_start(mysql)
 @csrf_protection
-@set_template('login.html')
+@set_template('login.html', cache_ttl=PAGE_CACHE_TTL)
 def login(session):
     warnings = []
     errors = []
@@ -237,7 +256,7 @@ def test(session, id=0):
 @app.route('/admin')
 @session_start(mysql)
 @require_admin
-@set_template('admin.html')
+@set_template('admin.html', stream=True)
 def admin(session):
     return dict()
 
@@ -261,7 +280,7 @@ for code in default_exceptions:
     func_name = 'error_{}'.format(code)
     func = create_error_function(func_name)
 
-    func = set_template('error.html', code, mysql)(func)
+    func = set_template('error.html', code, mysql, cache_ttl=PAGE_CACHE_TTL)(func)
     func = session_start(mysql)(func)
     func = app.errorhandler(code)(func)
 
@@ -0,0 +1,66 @@
+#Benchmark core.base_convert with text from 16 characters up to 1 MB
+#Run from the repository root with "python -m benchmarks.base_convert"
+from __future__ import absolute_import, division, print_function
+import random
+import sys
+import timeit
+
+from core.base_convert import get_codec
+
+
+SIZES = [16, 256, 4096, 65536, 1048576]
+
+CONVERSIONS = [(10, 64), (16, 64), (64, 16), (62, 10), (43, 220)]
+
+#Skip the one character at a time conversion above this size as it takes too long
+REFERENCE_MAX_SIZE = 4096
+
+
+def reference_decode(codec, string):
+    """Convert text to an integer one character at a time."""
+    remaining = 0
+    for i, v in enumerate(string[::-1]):
+        remaining += codec.lookup[v] * codec.base ** i
+    return remaining
+
+
+def reference_encode(codec, number):
+    """Convert an integer to text one character at a time."""
+    result = []
+    while number:
+        number, remainder = divmod(number, codec.base)
+        result.append(codec.characters[remainder])
+    return ''.join(result[::-1])
+
+
+def _time(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def run(sizes=SIZES, conversions=CONVERSIONS, seed=0):
+    rng = random.Random(seed)
+    print('{:>14} {:>9} {:>12} {:>12} {:>12} {:>12}'.format(
+        'conversion', 'size', 'decode', 'encode', 'ref decode', 'ref encode'))
+    for start_base, end_base in conversions:
+        decoder = get_codec(start_base)
+        encoder = get_codec(end_base)
+        for size in sizes:
+            string = ''.join(rng.choice(decoder.characters[1:]) for _ in range(size))
+            number = decoder.decode(string)
+            repeat = 5 if size <= 4096 else 1
+            
+            decode_time = _time(lambda: decoder.decode(string), repeat)
+            encode_time = _time(lambda: encoder.encode(number), repeat)
+            if size <= REFERENCE_MAX_SIZE:
+                ref_decode = '{:12.6f}'.format(_time(lambda: reference_decode(decoder, string), repeat))
+                ref_encode = '{:12.6f}'.format(_time(lambda: reference_encode(encoder, number), repeat))
+            else:
+                ref_decode = ref_encode = '{:>12}'.format('-')
+            
+            print('{:>14} {:>9} {:12.6f} {:12.6f} {} {}'.format(
+                '{} -> {}'.format(start_base, end_base), size, decode_time, encode_time, ref_decode, ref_encode))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,258 @@
+#Benchmark extensions.flask_compress by sending responses through a Flask test client
+#Run from the repository root with "python -m benchmarks.compress"
+#Use --save to write the results as a baseline, and --compare to check against one.
+from __future__ import absolute_import, division, print_function
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+
+from flask import Flask, Response, render_template, json as flask_json
+
+from extensions.flask_compress import CODECS, Compress, LRUCache
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TEMPLATE_FOLDERS = [os.path.join(ROOT, 'templates'), os.path.join(ROOT, 'flaskapp', 'templates')]
+
+STATIC_FOLDERS = [os.path.join(ROOT, 'static'), os.path.join(ROOT, 'flaskapp', 'static')]
+
+STATIC_MIMETYPES = {'.css': 'text/css', '.js': 'application/javascript'}
+
+#Number of users in each /users response, to cover a range of sizes
+USER_COUNTS = [10, 1000, 20000]
+
+LEVELS = {
+    'gzip': [1, 6, 9],
+    'deflate': [1, 6, 9],
+    'br': [1, 5, 11],
+    'zstd': [1, 3, 19],
+}
+
+#Keep sending requests for this long for each result (but at least MIN_REQUESTS)
+DURATION = 0.5
+
+MIN_REQUESTS = 5
+
+#Number of requests to trace for memory usage, as tracing slows everything down
+TRACE_REQUESTS = 3
+
+#A result counts as a regression if it gets this much slower
+REGRESSION_THRESHOLD = 0.1
+
+#Values passed to templates that the views normally add
+TEMPLATE_CONTEXT = dict(
+    get_data={}, post_data={}, session={}, debug={}, errors=[], warnings=[],
+    login_url='/login?login=1', error_format='200 OK', autofocus=None,
+    email_preview={'subject': 'Subject', 'content': 'Content'}, email_content='',
+    template_name='Template', t_id=1,
+    #Helpers added by extensions.assets and extensions.bundles
+    asset_url=lambda filename, **kwargs: '/static/' + filename,
+    bundle_url=lambda name, **kwargs: '/static/bundles/' + name,
+)
+
+
+def render_templates():
+    """Render every template that works without a database."""
+    corpus = []
+    for folder in TEMPLATE_FOLDERS:
+        app = Flask(__name__, template_folder=folder, static_folder=STATIC_FOLDERS[0])
+        app.secret_key = 'benchmark'
+
+        #Link to any endpoint, as the real views aren't registered
+        app.url_build_error_handlers.append(lambda error, endpoint, values: '/' + endpoint)
+
+        with app.test_request_context():
+            for filename in sorted(os.listdir(folder)):
+                if not filename.endswith('.html'):
+                    continue
+                try:
+                    html = render_template(filename, **TEMPLATE_CONTEXT)
+                except Exception as e:
+                    print('Skipping {}: {}'.format(filename, e), file=sys.stderr)
+                    continue
+                name = os.path.relpath(os.path.join(folder, filename), ROOT)
+                corpus.append((name, html.encode('utf-8'), 'text/html'))
+    return corpus
+
+
+def generate_users(count, seed=0):
+    """Build the same JSON as /users for a number of fake users."""
+    rng = random.Random(seed)
+    names = ['admin', 'guest', 'peter', 'alice', 'bob', 'carol', 'dave', 'eve']
+    users = []
+    for i in range(count):
+        username = '{}{}'.format(rng.choice(names), rng.randint(0, 99999))
+        users.append(dict(username=username, email='{}@example.com'.format(username)))
+    return flask_json.dumps(users).encode('utf-8')
+
+
+def load_corpus():
+    """Get a list of (name, data, mimetype) to send as responses."""
+    corpus = render_templates()
+    for count in USER_COUNTS:
+        corpus.append(('/users ({} users)'.format(count), generate_users(count), 'application/json'))
+    for folder in STATIC_FOLDERS:
+        for filename in sorted(os.listdir(folder)):
+            mimetype = STATIC_MIMETYPES.get(os.path.splitext(filename)[1])
+            if mimetype is None:
+                continue
+            with open(os.path.join(folder, filename), 'rb') as f:
+                data = f.read()
+            name = os.path.relpath(os.path.join(folder, filename), ROOT)
+            corpus.append((name, data, mimetype))
+    return corpus
+
+
+def create_app(corpus, codec, level, cache):
+    app = Flask(__name__)
+    app.config['COMPRESS_ALGORITHM'] = [codec]
+    app.config['COMPRESS_LEVEL'] = app.config['COMPRESS_BR_LEVEL'] = app.config['COMPRESS_ZSTD_LEVEL'] = level
+    if cache:
+        app.config['COMPRESS_CACHE_BACKEND'] = LRUCache
+    Compress(app)
+
+    def view(index):
+        name, data, mimetype = corpus[index]
+        return Response(data, mimetype=mimetype)
+    app.add_url_rule('/<int:index>', 'view', view)
+    return app
+
+
+def percentile(values, percent):
+    """Get a percentile of sorted values using the nearest rank."""
+    index = max(0, int(round(percent / 100 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def measure(client, url, encoding, duration=DURATION):
+    headers = {'Accept-Encoding': encoding}
+    timer = timeit.default_timer
+    times = []
+    size = None
+    started = timer()
+    while len(times) < MIN_REQUESTS or timer() - started < duration:
+        start = timer()
+        response = client.get(url, headers=headers)
+        data = response.get_data()
+        times.append(timer() - start)
+        size = len(data)
+    total = sum(times)
+
+    allocated = None
+    if tracemalloc is not None:
+        allocated = 0
+        for _ in range(TRACE_REQUESTS):
+            tracemalloc.start()
+            client.get(url, headers=headers).get_data()
+            allocated = max(allocated, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+    times.sort()
+    return dict(
+        requests=len(times),
+        throughput=len(times) / total,
+        p50=percentile(times, 50),
+        p95=percentile(times, 95),
+        p99=percentile(times, 99),
+        compressed=size,
+        allocated=allocated,
+    )
+
+
+def run(corpus=None, codecs=None, caches=(False, True), duration=DURATION):
+    """Send every response with each codec, level and cache setting.
+    An "identity" result with no compression is included to compare against.
+    """
+    if corpus is None:
+        corpus = load_corpus()
+    if codecs is None:
+        codecs = [i for i in LEVELS if i in CODECS]
+    configs = [('identity', None, False)]
+    for codec in codecs:
+        for level in LEVELS[codec]:
+            for cache in caches:
+                configs.append((codec, level, cache))
+
+    print('{:>30} {:>8} {:>5} {:>5} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9} {:>10}'.format(
+        'response', 'codec', 'level', 'cache', 'size', 'ratio', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'allocated'))
+    results = []
+    for codec, level, cache in configs:
+        app = create_app(corpus, codec if codec != 'identity' else 'gzip', level or 1, cache)
+        client = app.test_client()
+        for index, (name, data, mimetype) in enumerate(corpus):
+            result = measure(client, '/{}'.format(index), codec, duration)
+            result.update(name=name, codec=codec, level=level, cache=cache, size=len(data),
+                          ratio=result['compressed'] / len(data))
+            results.append(result)
+            print('{:>30} {:>8} {:>5} {:>5} {:>9} {:>7.3f} {:>9.1f} {:>9.3f} {:>9.3f} {:>9.3f} {:>10}'.format(
+                name[-30:], codec, level or '-', 'yes' if cache else 'no', len(data), result['ratio'],
+                result['throughput'], result['p50'] * 1000, result['p95'] * 1000, result['p99'] * 1000,
+                '-' if result['allocated'] is None else result['allocated']))
+            sys.stdout.flush()
+    return results
+
+
+def _result_key(result):
+    return (result['name'], result['codec'], result['level'], result['cache'])
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Print how each result changed since the baseline.
+    Returns the number of results that got slower than the threshold allows.
+    """
+    previous = {_result_key(i): i for i in baseline['results']}
+    regressions = 0
+    print('{:>30} {:>8} {:>5} {:>5} {:>10} {:>10} {:>10}'.format(
+        'response', 'codec', 'level', 'cache', 'p50', 'req/s', 'ratio'))
+    for result in results:
+        old = previous.get(_result_key(result))
+        if old is None:
+            continue
+        p50 = result['p50'] / old['p50'] - 1
+        throughput = result['throughput'] / old['throughput'] - 1
+        ratio = result['ratio'] - old['ratio']
+        regressed = p50 > threshold
+        regressions += regressed
+        print('{:>30} {:>8} {:>5} {:>5} {:>+9.1%} {:>+9.1%} {:>+10.4f}{}'.format(
+            result['name'][-30:], result['codec'], result['level'] or '-', 'yes' if result['cache'] else 'no',
+            p50, throughput, ratio, ' *' if regressed else ''))
+    print('{} regressions over {:.0%}'.format(regressions, threshold))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark response compression.')
+    parser.add_argument('--codec', action='append', help='codec to test (can be repeated)')
+    parser.add_argument('--duration', type=float, default=DURATION, help='seconds to spend on each result')
+    parser.add_argument('--no-cache', action='store_true', help='only test without the cache')
+    parser.add_argument('--save', help='write the results to a JSON file')
+    parser.add_argument('--compare', help='compare the results to a saved JSON file')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(args)
+
+    caches = (False,) if args.no_cache else (False, True)
+    results = run(codecs=args.codec, caches=caches, duration=args.duration)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(dict(python=platform.python_version(), results=results), f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+#Benchmark extensions.html2text on newsletters from a few KB up to a few MB
+#Run from the repository root with "python -m benchmarks.html2text"
+from __future__ import absolute_import, division, print_function
+import random
+import sys
+import timeit
+
+from extensions import html2text as module
+
+
+SIZES = [4096, 65536, 1048576, 4194304]
+
+#Blocks that a newsletter is built from, with a field to make each one different
+NEWSLETTER_BLOCKS = [
+    '<div class="article"><h2>Article {}</h2>\n  <p>Lorem ipsum dolor sit amet, <b>consectetur</b> adipiscing elit. '
+    'Sed do eiusmod tempor&nbsp;incididunt ut labore &amp; dolore magna aliqua.</p>\n</div>\n',
+    '<table width="100%"><tr><td><img src="https://example.com/{}.png" alt="Image"></td>'
+    '<td><a href="https://example.com/read/{}">Read more &raquo;</a></td></tr></table>\n',
+    '<p style="color: #333">Ut enim ad minim veniam, quis nostrud exercitation &#8212; ullamco '
+    'laboris nisi ut aliquip ex ea commodo consequat {}.<br>Duis aute irure dolor.</p>\n',
+    '<ul>\n  <li>First point {}</li>\n  <li>Second &quot;point&quot;</li>\n</ul>\n',
+]
+
+NEWSLETTER_HEAD = ('<html><head><style>body {{ font-family: sans-serif; }}</style></head>\n'
+                   '<body><div class="header">Newsletter {}</div>\n')
+
+NEWSLETTER_FOOT = '<div class="footer">&copy; Website. <a href="https://example.com/unsubscribe">Unsubscribe</a></div></body></html>'
+
+
+def newsletter(size, seed=0):
+    """Build a newsletter of around "size" characters."""
+    rng = random.Random(seed)
+    parts = [NEWSLETTER_HEAD.format(seed)]
+    total = len(parts[0])
+    i = 0
+    while total < size:
+        block = rng.choice(NEWSLETTER_BLOCKS).format(i, i)
+        parts.append(block)
+        total += len(block)
+        i += 1
+    parts.append(NEWSLETTER_FOOT)
+    return u''.join(parts)
+
+
+def _time(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def _uncached(html):
+    try:
+        return module._convert(html)
+    except module._Fallback:
+        return module.html2text_legacy(html)
+
+
+def run(sizes=SIZES):
+    print('{:>9} {:>12} {:>12} {:>12} {:>9}'.format('size', 'legacy', 'single pass', 'cached', 'speedup'))
+    for size in sizes:
+        html = newsletter(size)
+        if _uncached(html) != module.html2text_legacy(html):
+            raise ValueError('output differs from html2text_legacy at size {}'.format(size))
+        repeat = 5 if size <= 65536 else 2
+
+        legacy_time = _time(lambda: module.html2text_legacy(html), repeat)
+        single_time = _time(lambda: _uncached(html), repeat)
+        module.html2text(html)
+        cached_time = _time(lambda: module.html2text(html), repeat)
+
+        print('{:>9} {:12.6f} {:12.6f} {:12.6f} {:>8.2f}x'.format(
+            size, legacy_time, single_time, cached_time, legacy_time / single_time))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    run()
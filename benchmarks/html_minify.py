@@ -0,0 +1,88 @@
+#Benchmark extensions.html_minify on the rendered templates and some large pages
+#Run from the repository root with "python -m benchmarks.html_minify"
+#Shows how many bytes minifying saves before and after gzip, and how long it
+#takes compared to the time it saves when compressing.
+from __future__ import absolute_import, division, print_function
+import gzip
+import io
+import sys
+import timeit
+
+from benchmarks.compress import render_templates
+from extensions.html_minify import minify_html
+
+
+#Number of rows in each generated table page
+TABLE_ROWS = [100, 1000, 10000]
+
+GZIP_LEVEL = 6
+
+REPEAT = 5
+
+TABLE_ROW = u'''
+        <tr>
+          <td>{0}</td>
+          <td>
+            <a href="/users/{0}">user{0}</a>
+          </td>
+          <td>user{0}@example.com</td>
+          <!-- permission {1} -->
+          <td>{1}</td>
+        </tr>'''
+
+
+def table_page(rows):
+    """Build an indented page like the admin user lists."""
+    body = u''.join(TABLE_ROW.format(i, i % 256) for i in range(rows))
+    return (u'<!doctype html>\n<html>\n  <head>\n    <title>Users</title>\n  </head>\n  <body>\n'
+            u'    <table>{}\n    </table>\n    <pre>\n  Generated page\n    </pre>\n  </body>\n</html>\n'.format(body))
+
+
+def load_pages():
+    """Get a list of (name, html) to minify."""
+    pages = [(name, data.decode('utf-8')) for name, data, _ in render_templates()]
+    for rows in TABLE_ROWS:
+        pages.append(('table ({} rows)'.format(rows), table_page(rows)))
+    return pages
+
+
+def gzip_data(data, level=GZIP_LEVEL):
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=level) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+def _time(func, repeat=REPEAT):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def run(pages=None):
+    if pages is None:
+        pages = load_pages()
+    print('{:>30} {:>9} {:>9} {:>7} {:>8} {:>8} {:>7} {:>10} {:>10}'.format(
+        'page', 'size', 'minified', 'saved', 'gzip', 'gzip min', 'saved', 'minify ms', 'gzip ms'))
+    total_saved = total_gzip_saved = 0
+    for name, html in pages:
+        minified = minify_html(html)
+        data = html.encode('utf-8')
+        minified_data = minified.encode('utf-8')
+        compressed = len(gzip_data(data))
+        compressed_minified = len(gzip_data(minified_data))
+
+        minify_time = _time(lambda: minify_html(html))
+        #Time saved by compressing less data, to weigh against the time spent minifying
+        gzip_saved = _time(lambda: gzip_data(data)) - _time(lambda: gzip_data(minified_data))
+
+        total_saved += len(data) - len(minified_data)
+        total_gzip_saved += compressed - compressed_minified
+        print('{:>30} {:>9} {:>9} {:>6.1%} {:>8} {:>8} {:>6.1%} {:>10.3f} {:>+10.3f}'.format(
+            name[-30:], len(data), len(minified_data), 1 - len(minified_data) / len(data),
+            compressed, compressed_minified, 1 - compressed_minified / compressed,
+            minify_time * 1000, -gzip_saved * 1000))
+        sys.stdout.flush()
+    print('Saved {} bytes in total, {} after gzip'.format(total_saved, total_gzip_saved))
+
+
+if __name__ == '__main__':
+    run()
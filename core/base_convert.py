@@ -1,8 +1,20 @@
 from __future__ import absolute_import, division
+import binascii
 import math
 import random
 import string
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    basestring
+except NameError:
+    basestring = str
+    long = int
+
 
 _ALL_CHARACTERS = [chr(i) for i in range(32, 256)]
 
@@ -14,6 +26,246 @@ DEFAULT_CHARACTERS = _BASE64_ORDER + ''.join(i for i in _ALL_CHARACTERS if i not
 
 ASCII_CHARACTERS = _BASE64_ORDER + ''.join(i for i in string.punctuation if i not in _BASE64_ORDER + _DISALLOW)
 
+#Unreserved characters, so the result can be used in a URL without quoting
+URL_SAFE_CHARACTERS = string.digits + string.ascii_letters + '-_.~'
+
+CODEC_CACHE_SIZE = 256
+
+#Number of bytes converted at a time when streaming with bases that aren't a power of two
+STREAM_BLOCK_SIZE = 32
+
+#Text longer than this is split in half when converting
+SPLIT_MIN_LENGTH = 64
+
+#Numbers below base ** (2 ** SPLIT_LEVEL) are converted one character at a time
+SPLIT_LEVEL = 6
+
+#The inbuilt int() is quadratic for bases that aren't a power of two
+NATIVE_MAX_LENGTH = 1024
+
+#Largest integers that can be converted as a batch with numpy
+BATCH_MAX_BITS = 128
+
+#Numbers with fewer bits than this use the inbuilt division
+DIVIDE_MIN_BITS = 4000
+
+_CODEC_CACHE = {}
+
+
+def _divide(a, b, n):
+    """Recursive division of a 2n bit integer by an n bit integer.
+    The inbuilt division is quadratic, whereas this is limited by the
+    speed of multiplication (from Burnikel and Ziegler, as used by the
+    _pylong module of newer Python versions).
+    Requires a < 2 ** n * b, and returns the quotient and remainder.
+    """
+    if a.bit_length() - n <= DIVIDE_MIN_BITS:
+        return divmod(a, b)
+    pad = n & 1
+    if pad:
+        a <<= 1
+        b <<= 1
+        n += 1
+    half_n = n >> 1
+    mask = (1 << half_n) - 1
+    b1, b2 = b >> half_n, b & mask
+    q1, r = _divide_3n2n(a >> n, (a >> half_n) & mask, b, b1, b2, half_n)
+    q2, r = _divide_3n2n(r, a & mask, b, b1, b2, half_n)
+    if pad:
+        r >>= 1
+    return q1 << half_n | q2, r
+
+
+def _divide_3n2n(a12, a3, b, b1, b2, n):
+    """Helper function for _divide."""
+    if a12 >> n == b1:
+        q, r = (1 << n) - 1, a12 - (b1 << n) + b1
+    else:
+        q, r = _divide(a12, b1, n)
+    r = (r << n | a3) - q * b2
+    while r < 0:
+        q -= 1
+        r += b
+    return q, r
+
+
+class BaseCodec(object):
+    """Convert between integers and text in a single base.
+    The character lookups are calculated once, so the same codec can
+    be reused for any number of conversions.
+    Use get_codec() to share codecs instead of creating new ones.
+    
+    A seed will shuffle the characters with a private random number
+    generator, so the global random state is left untouched.
+    
+    >>> codec = BaseCodec(16)
+    >>> codec.encode(255)
+    'ff'
+    >>> codec.decode('ff')
+    255
+    >>> codec.encode(255, length=4)
+    'ffgg'
+    >>> len(BaseCodec(10).encode(10 ** 200, length=210))
+    210
+    """
+    
+    def __init__(self, base=None, allowed_characters=None, seed=None, ascii_only=False):
+        
+        #Define the character set if not set (or strip characters)
+        if allowed_characters is None:
+            if ascii_only:
+                allowed_characters = ASCII_CHARACTERS
+            else:
+                allowed_characters = DEFAULT_CHARACTERS
+        elif ascii_only:
+            allowed_characters = ''.join(i for i in allowed_characters if i in ASCII_CHARACTERS)
+        characters = list(allowed_characters)
+        
+        if seed is not None:
+            random.Random(seed).shuffle(characters)
+        
+        #Make sure the base is valid (the extra character is used for padding)
+        if base is None:
+            base = len(characters) - 1
+        else:
+            base = int(base)
+        if base > len(characters) - 1:
+            raise ValueError('base is too high')
+        elif base < 2:
+            raise ValueError('base is too low')
+        
+        self.base = base
+        self.seed = seed
+        self.characters = ''.join(characters[:base])
+        self.padding = characters[base]
+        self.lookup = {v: i for i, v in enumerate(self.characters)}
+        
+        #The inbuilt conversion can only be used with the standard characters
+        self._native = base <= 36 and self.characters == (string.digits + string.ascii_lowercase)[:base]
+        
+        #Power of two bases can map each character directly to a group of bits
+        self._bits = None
+        if not base & (base - 1):
+            self._bits = base.bit_length() - 1
+            bit_format = '{{:0{}b}}'.format(self._bits)
+            self._bit_lookup = {v: bit_format.format(i) for i, v in enumerate(self.characters)}
+            self._bit_reverse = {bit_format.format(i): v for i, v in enumerate(self.characters)}
+        
+        #Powers of the base, where _powers[i] is base ** (2 ** i)
+        self._powers = [base]
+    
+    def __repr__(self):
+        return '{}({!r}, seed={!r})'.format(self.__class__.__name__, self.base, self.seed)
+    
+    def _power(self, level):
+        """Get base ** (2 ** level), squaring the previous power as needed."""
+        powers = self._powers
+        while len(powers) <= level:
+            powers.append(powers[-1] * powers[-1])
+        return powers[level]
+    
+    def decode(self, string, strip_padding=True):
+        """Convert text to an integer."""
+        string = str(string)
+        if strip_padding:
+            string = string.rstrip(self.padding)
+        
+        #The inbuilt conversion is only linear for power of two bases
+        if self._native and (self._bits or len(string) <= NATIVE_MAX_LENGTH):
+            try:
+                return int(string, self.base)
+            except ValueError:
+                pass
+        
+        try:
+            if self._bits:
+                return self._decode_bits(string)
+            return self._decode_split(string)
+        except KeyError:
+            raise ValueError(u'string "{}" not valid for base {}'.format(string, self.base))
+    
+    def _decode_bits(self, string):
+        if not string:
+            return 0
+        lookup = self._bit_lookup
+        return int(''.join([lookup[i] for i in string]), 2)
+    
+    def _decode_split(self, string):
+        """Convert text to an integer by splitting it in half.
+        The upper half gets multiplied by a precalculated power of the
+        base, which is much faster than adding up each digit for long text.
+        """
+        length = len(string)
+        if length <= SPLIT_MIN_LENGTH:
+            base = self.base
+            lookup = self.lookup
+            remaining = 0
+            for character in string:
+                remaining = remaining * base + lookup[character]
+            return remaining
+        
+        #Split at the highest power of two below the length
+        level = (length - 1).bit_length() - 1
+        split = length - (1 << level)
+        return self._decode_split(string[:split]) * self._power(level) + self._decode_split(string[split:])
+    
+    def encode(self, number, length=None):
+        """Convert an integer to text.
+        If a length is given, padding will be added to the end to reach it.
+        """
+        remaining = int(number)
+        if remaining < 0:
+            raise ValueError('negative numbers are not supported')
+        
+        if not remaining:
+            result = []
+        elif self._bits:
+            result = self._encode_bits(remaining)
+        else:
+            result = []
+            self._encode_split(remaining, result)
+        
+        #The zero filled parts are multiple characters, so pad the joined text
+        result = ''.join(result)
+        if length is not None and len(result) < length:
+            result += self.padding * (length - len(result))
+        return result
+    
+    def _encode_bits(self, number):
+        bits = self._bits
+        binary = '{:b}'.format(number)
+        binary = '0' * (-len(binary) % bits) + binary
+        lookup = self._bit_reverse
+        return [lookup[binary[i:i+bits]] for i in range(0, len(binary), bits)]
+    
+    def _encode_split(self, number, result, width=0):
+        """Convert an integer to characters by dividing it in half.
+        Each division is by a precalculated power of the base, and the lower
+        half is filled with zeros to the exact number of characters it covers.
+        """
+        if number < self._power(SPLIT_LEVEL):
+            
+            #Get the characters in reverse order (remainder from dividing the integer by the base)
+            base = self.base
+            characters = self.characters
+            digits = []
+            while number:
+                number, remainder = divmod(number, base)
+                digits.append(characters[remainder])
+            if len(digits) < width:
+                digits.append(characters[0] * (width - len(digits)))
+            result.extend(reversed(digits))
+            return
+        
+        #Find the highest power that fits, the upper half is then smaller than it
+        level = SPLIT_LEVEL
+        while self._power(level + 1) <= number:
+            level += 1
+        power = self._power(level)
+        upper, lower = _divide(number, power, power.bit_length())
+        self._encode_split(upper, result, width - (1 << level))
+        self._encode_split(lower, result, 1 << level)
+
 
 def base_convert(string, start_base=None, end_base=None, 
                  padding=False, strip_padding=True,
@@ -62,83 +314,296 @@ def base_convert(string, start_base=None, end_base=None,
     'abcdef0123456789'
     """
     
-    #Define the character set if not set (or strip characters)
-    if allowed_characters is None:
-        if ascii_only:
-            allowed_characters = ASCII_CHARACTERS
-        else:
-            allowed_characters = DEFAULT_CHARACTERS
-    elif ascii_only:
-        allowed_characters = ''.join(i for i in allowed_characters if i in ASCII_CHARACTERS)
-    char_input = list(allowed_characters)
-    
-    #Define the bases if not set
-    if start_base is None:
-        start_base = len(char_input) - 1
-    else:
-        start_base = int(start_base)
-    if end_base is None:
-        end_base = len(char_input) - 1
-    else:
-        end_base = int(end_base)
-    
-    #Shuffle list if any seeds are set
-    if seed_input is not None or seed_output is not None:
-        char_output = list(char_input)
-        if seed_input is not None:
-            random.seed(seed_input)
-            random.shuffle(char_input)
-        if seed_output is not None:
-            random.seed(seed_output)
-            random.shuffle(char_output)
-    else:
-        char_output = char_input
-        
-    #Limit the characters that can be used
-    input_padding = char_input[start_base]
-    output_padding = char_output[end_base]
-    char_input = char_input[:start_base]
-    char_output = char_output[:-1]
-    
-    #Make sure bases are valid
-    len_input = len(char_input)
-    len_output = len(char_output)
-    if start_base > len_input or end_base > len_output:
-        raise ValueError('base is too high')
-    elif min(start_base, end_base) < 2:
-        raise ValueError('base is too low')
+    decoder = get_codec(start_base, allowed_characters, seed_input, ascii_only)
+    encoder = get_codec(end_base, allowed_characters, seed_output, ascii_only)
     
     string = str(string)
     if strip_padding:
-        string = string.rstrip(input_padding)
+        string = string.rstrip(decoder.padding)
+    
+    #Fill the end characters to pad it out
+    length = None
+    if padding:
+        length = int(math.ceil(len(string) / math.log(encoder.base, decoder.base)))
     
-    #Convert to integer (manually do it if too large for the inbuilt conversion)
+    return encoder.encode(decoder.decode(string, strip_padding=False), length)
+
+
+def get_codec(base=None, allowed_characters=None, seed=None, ascii_only=False):
+    """Get a cached BaseCodec, creating it if it doesn't already exist."""
+    if base is not None:
+        base = int(base)
+    key = (base, allowed_characters, seed, ascii_only)
     try:
-        remaining = int(string, start_base)
-    except ValueError:
-        lookup = {v: i for i, v in enumerate(char_input)}
-        remaining = 0
-        for i, v in enumerate(string[::-1]):
-            try:
-                remaining += lookup[v] * start_base ** i
-            except KeyError:
-                raise ValueError(u'string "{}" not valid for base {}'.format(string, start_base))
+        return _CODEC_CACHE[key]
+    except KeyError:
+        pass
+    
+    codec = BaseCodec(base, allowed_characters, seed, ascii_only)
+    if len(_CODEC_CACHE) >= CODEC_CACHE_SIZE:
+        _CODEC_CACHE.clear()
+    _CODEC_CACHE[key] = codec
+    return codec
+    
+    
+def base_convert_batch(values, end_base=None, padding=False, seed_output=None,
+                       allowed_characters=None, ascii_only=False):
+    """Convert many integers or hex strings at once.
+    The result is identical to calling base_convert on each value, with
+    integers treated as base 10 and strings as base 16.
+    
+    If numpy is installed, values of up to 128 bits are converted with
+    array operations instead of one Python call each, which makes it
+    suitable for things like converting the uuid4().hex of every row.
+    
+    >>> base_convert_batch(['ff', '531fac3a92'], 43)
+    ['5E', '1dkmoofz']
+    >>> base_convert_batch([255, 0], 16, padding=True)
+    ['ffg', 'g']
+    """
+    if numpy is not None:
+        encoder = get_codec(end_base, allowed_characters, seed_output, ascii_only)
+        batch = _batch_limbs(values)
+        if batch is not None:
+            start_base, limbs, lengths = batch
+            if not padding:
+                lengths = None
+            return _batch_encode(encoder, limbs, lengths, start_base)
     
-    #Get the characters in reverse order (remainder from dividing the integer by the base)
     result = []
-    while remaining:
-        remaining, remainder = divmod(remaining, end_base)
-        result.append(char_output[remainder])
+    for value in values:
+        start_base = 16 if isinstance(value, basestring) else 10
+        result.append(base_convert(value, start_base, end_base, padding=padding, seed_output=seed_output,
+                                   allowed_characters=allowed_characters, ascii_only=ascii_only))
+    return result
+
+
+#Values of hex characters, anything invalid is set to 255
+if numpy is not None:
+    _HEX_VALUES = numpy.full(256, 255, dtype=numpy.uint8)
+    for _i, _v in enumerate('0123456789abcdef'):
+        _HEX_VALUES[ord(_v)] = _i
+        _HEX_VALUES[ord(_v.upper())] = _i
+    
+    _LIMB_BITS = numpy.uint64(32)
+    
+    _LIMB_MASK = numpy.uint64(0xffffffff)
+    
+    _DECIMAL_POWERS = numpy.array([10 ** i for i in range(1, 20)], dtype=numpy.uint64)
+
+
+def _batch_limbs(values):
+    """Split the values into 32 bit limbs for a batch conversion.
+    Returns the base of the values, the limbs (most significant first),
+    and the length of each value as text (for padding).
+    None is returned if the values can't be converted as a batch.
+    """
+    array = numpy.asarray(values)
+    if not array.size or array.ndim != 1:
+        return None
+    
+    #Integers (converted the same as base 10 text)
+    if array.dtype.kind in 'iu' or (array.dtype == object and isinstance(array[0], (int, long))):
+        if array.dtype == object:
+            try:
+                if min(values) < 0:
+                    raise ValueError('negative numbers are not supported')
+            except TypeError:
+                return None
+            if max(values) >> BATCH_MAX_BITS:
+                return None
+            high = numpy.array([i >> 64 for i in values], dtype=numpy.uint64)
+            low = numpy.array([i & 0xffffffffffffffff for i in values], dtype=numpy.uint64)
+            parts = [high, low]
+            lengths = numpy.array([len(str(i)) for i in values])
+        else:
+            if array.dtype.kind == 'i' and (array < 0).any():
+                raise ValueError('negative numbers are not supported')
+            low = array.astype(numpy.uint64)
+            parts = [low]
+            lengths = numpy.searchsorted(_DECIMAL_POWERS, low, side='right') + 1
+        limbs = numpy.empty((len(low), 2 * len(parts)), dtype=numpy.uint64)
+        for i, part in enumerate(parts):
+            limbs[:, 2 * i] = part >> _LIMB_BITS
+            limbs[:, 2 * i + 1] = part & _LIMB_MASK
+        return 10, limbs, lengths
+    
+    #Hex strings
+    if array.dtype.kind == 'U':
+        try:
+            array = array.astype('S')
+        except UnicodeEncodeError:
+            return None
+    if array.dtype.kind != 'S' or array.dtype.itemsize > BATCH_MAX_BITS // 4:
+        return None
+    lengths = numpy.char.str_len(array)
+    width = array.dtype.itemsize
+    width += -width % 8
+    if width != array.dtype.itemsize or lengths.min() != width:
+        array = numpy.char.rjust(array, width, b'0')
+    nibbles = _HEX_VALUES[numpy.ascontiguousarray(array).view(numpy.uint8)].reshape(len(array), width // 2, 2)
+    if nibbles.max() == 255:
+        return None
+    
+    #Join pairs of characters into bytes, then read every 4 bytes as a limb
+    octets = numpy.ascontiguousarray(nibbles[:, :, 0] << 4 | nibbles[:, :, 1])
+    return 16, octets.view('>u4').astype(numpy.uint64), lengths
+
+
+def _batch_encode(codec, limbs, lengths, start_base):
+    """Convert an array of limbs to text with array operations.
+    Each step divides every value by the largest power of the base that
+    fits in a limb, one limb at a time, then the remainder is split into
+    individual characters (from last to first).
+    """
+    count = len(limbs)
+    limbs = [numpy.ascontiguousarray(limbs[:, i]) for i in range(limbs.shape[1])]
+    
+    base = codec.base
+    step = 1
+    while base ** (step + 1) < 1 << 32:
+        step += 1
+    divisor = numpy.uint64(base ** step)
+    num_digits = int(math.ceil(len(limbs) * 32 / math.log(base, 2)))
+    num_digits += -num_digits % step
+    
+    base = numpy.uint64(base)
+    digits = numpy.empty((count, num_digits), dtype=numpy.uint8)
+    for i in range(num_digits, 0, -step):
+        remainder = numpy.zeros(count, dtype=numpy.uint64)
+        for limb in limbs:
+            current = (remainder << _LIMB_BITS) | limb
+            limb[...] = current // divisor
+            remainder = current % divisor
+        for j in range(i - 1, i - step - 1, -1):
+            digits[:, j] = remainder % base
+            remainder //= base
+        
+        #Stop dividing limbs once they are empty
+        while limbs and not limbs[0].any():
+            del limbs[0]
+    
+    #Join the characters of each row into a single string
+    characters = numpy.array(list(codec.characters))
+    text = numpy.ascontiguousarray(characters[digits])
+    text = text.view('{}{}'.format(text.dtype.kind, num_digits)).ravel()
+    text = numpy.char.lstrip(text, codec.characters[0])
     
     #Fill the end characters to pad it out
-    if padding:
-        expected_length = int(math.ceil(len(string) / math.log(end_base, start_base)))
-        extra_characters = expected_length - len(result)
-        if extra_characters:
-            result = [output_padding] * extra_characters + result
+    if lengths is not None:
+        widths = numpy.ceil(lengths / math.log(codec.base, start_base)).astype(int)
+        text = numpy.char.ljust(text, widths, codec.padding)
+    return text.tolist()
+
+
+def _stream_layout(codec, block_size=None):
+    """Get the number of bytes in a block, and how many characters
+    are used for every possible number of bytes in a block.
+    
+    Power of two bases are treated as a continuous stream of bits, so
+    any multiple of the bits per character is a full block.
+    Other bases convert each block of bytes as a separate number.
+    """
+    if codec._bits:
+        bits = codec._bits
+        block_size = max(1, (block_size or 3 * STREAM_BLOCK_SIZE) // bits) * bits
+        lengths = [-(-8 * i // bits) for i in range(block_size + 1)]
+    else:
+        block_size = block_size or STREAM_BLOCK_SIZE
+        lengths = [0]
+        power = 1
+        for i in range(1, block_size + 1):
+            length = lengths[-1]
+            while power < 1 << 8 * i:
+                power *= codec.base
+                length += 1
+            lengths.append(length)
+    return block_size, lengths
+
+
+def encode_stream(chunks, base=None, block_size=None, seed=None,
+                  allowed_characters=None, ascii_only=False):
+    """Encode an iterable of byte strings, yielding the text as it goes.
+    Only a single block is held in memory between chunks, so it can be
+    used on files or other large data.
     
-    return ''.join(result[::-1])
+    >>> token = ''.join(encode_stream([b'hello ', b'world'], 64, allowed_characters=URL_SAFE_CHARACTERS))
+    >>> print(token)
+    q6lIr6YwtSZOr6g
+    >>> b''.join(decode_stream([token[:5], token[5:]], 64, allowed_characters=URL_SAFE_CHARACTERS)) == b'hello world'
+    True
+    """
+    codec = get_codec(base, allowed_characters, seed, ascii_only)
+    block_size, lengths = _stream_layout(codec, block_size)
+    
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) < block_size:
+            continue
+        
+        #Power of two bases can convert every full block at once
+        end = len(buffer) - len(buffer) % block_size
+        if codec._bits:
+            yield _encode_block(codec, buffer[:end], end * 8 // codec._bits)
+        else:
+            yield ''.join(_encode_block(codec, buffer[i:i+block_size], lengths[block_size])
+                          for i in range(0, end, block_size))
+        buffer = buffer[end:]
     
+    if buffer:
+        yield _encode_block(codec, buffer, lengths[len(buffer)])
+
+
+def _encode_block(codec, data, length):
+    number = int(binascii.hexlify(data), 16)
+    if codec._bits:
+        number <<= length * codec._bits - len(data) * 8
+    text = codec.encode(number)
+    return codec.characters[0] * (length - len(text)) + text
+
+
+def decode_stream(chunks, base=None, block_size=None, seed=None,
+                  allowed_characters=None, ascii_only=False):
+    """Decode an iterable of text from encode_stream, yielding the bytes.
+    The same base, block size and characters must be used.
+    """
+    codec = get_codec(base, allowed_characters, seed, ascii_only)
+    block_size, lengths = _stream_layout(codec, block_size)
+    block_length = lengths[block_size]
+    sizes = {length: size for size, length in enumerate(lengths)}
+    
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) < block_length:
+            continue
+        
+        end = len(buffer) - len(buffer) % block_length
+        if codec._bits:
+            yield _decode_block(codec, buffer[:end], end * codec._bits // 8)
+        else:
+            yield b''.join(_decode_block(codec, buffer[i:i+block_length], block_size)
+                           for i in range(0, end, block_length))
+        buffer = buffer[end:]
+    
+    if buffer:
+        try:
+            size = sizes[len(buffer)]
+        except KeyError:
+            raise ValueError('incomplete block of {} characters'.format(len(buffer)))
+        yield _decode_block(codec, buffer, size)
+
+
+def _decode_block(codec, text, size):
+    number = codec.decode(text, strip_padding=False)
+    if codec._bits:
+        number >>= len(text) * codec._bits - size * 8
+    if number >> size * 8:
+        raise ValueError(u'string "{}" is too large for {} bytes'.format(text, size))
+    return binascii.unhexlify('{:0{}x}'.format(number, size * 2))
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
\ No newline at end of file
@@ -0,0 +1,148 @@
+#Detect passwords that are close variants of a common password
+#Uses a symmetric delete index so each lookup is a handful of dictionary hits,
+#no matter how large the list of common passwords is.
+from __future__ import absolute_import
+import string
+
+
+#Characters commonly substituted for letters, folded into a single letter each
+#"l" is folded into "i" so that "1" can stand for either
+_LEET_FROM = '@4381!|l05$7+92'
+_LEET_TO = 'aaebiiiiosstggz'
+
+_LEET_MAP = dict(zip(_LEET_FROM, _LEET_TO))
+
+_STRIP_CHARACTERS = string.digits + string.punctuation + string.whitespace
+
+#Stop "123dog123" matching "dog" as too much of the password was stripped
+STRIPPED_MIN_LENGTH = 4
+
+#Shorter values than this only match exactly (after normalisation)
+FUZZY_MIN_LENGTH = 6
+
+FUZZY_MAX_DISTANCE = 1
+
+
+def normalise_password(password):
+    """Lowercase the password and undo any leetspeak substitutions."""
+    return ''.join(_LEET_MAP.get(i, i) for i in password.lower())
+
+
+def password_variants(password):
+    """Get the normalised forms of a password to check against the index.
+    Digits and symbols are stripped from both ends to catch things like
+    "password123!" or "1password", as well as the full normalised value.
+    """
+    lowered = password.lower()
+    variants = set([normalise_password(lowered)])
+    stripped = lowered.strip(_STRIP_CHARACTERS)
+    if len(stripped) >= STRIPPED_MIN_LENGTH:
+        variants.add(normalise_password(stripped))
+    return variants
+
+
+def _deletes(word, distance):
+    """Get every string that can be made by deleting up to "distance" characters."""
+    results = set([word])
+    current = results
+    for _ in range(distance):
+        current = set(i[:j] + i[j+1:] for i in current for j in range(len(i)))
+        results |= current
+    return results
+
+
+def bounded_distance(a, b, limit):
+    """Calculate the Levenshtein distance between two strings.
+    Gives up once the distance goes over the limit, returning limit + 1.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j-1] + 1, previous[j-1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+class CommonPasswordIndex(object):
+    """Index of common passwords that allows near matches to be found.
+
+    Every password is normalised (lowercase, leetspeak undone, digits and
+    symbols stripped from the ends), and each normalised value is stored
+    along with all strings that can be made by deleting characters from it.
+    A lookup does the same to the input, so a match within the edit distance
+    is found with around len(password) dictionary lookups.
+
+    >>> index = CommonPasswordIndex(['password', 'qwerty', 'dragon'])
+    >>> index.match('P@ssw0rd1!')
+    'password'
+    >>> index.match('passwort')
+    'password'
+    >>> index.match('qwerty')
+    'qwerty'
+    >>> index.match('correct horse') is None
+    True
+    """
+
+    def __init__(self, passwords, max_distance=FUZZY_MAX_DISTANCE, min_length=FUZZY_MIN_LENGTH):
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self.max_length = 0
+        self.exact = {}
+        self.deletes = {}
+        for password in passwords:
+            if password:
+                self.add(password)
+
+    def add(self, password):
+        for variant in password_variants(password):
+            self.exact.setdefault(variant, password)
+            if len(variant) < self.min_length:
+                continue
+            self.max_length = max(self.max_length, len(variant))
+
+            #Store a single value where possible as most deletes are unique
+            for deleted in _deletes(variant, self.max_distance):
+                existing = self.deletes.get(deleted)
+                if existing is None:
+                    self.deletes[deleted] = variant
+                elif isinstance(existing, tuple):
+                    if variant not in existing:
+                        self.deletes[deleted] = existing + (variant,)
+                elif existing != variant:
+                    self.deletes[deleted] = (existing, variant)
+
+    def match(self, password):
+        """Return the common password that is similar, or None if no match."""
+        variants = password_variants(password)
+        for variant in variants:
+            try:
+                return self.exact[variant]
+            except KeyError:
+                pass
+
+        for variant in variants:
+            if not self.min_length <= len(variant) <= self.max_length + self.max_distance:
+                continue
+            for deleted in _deletes(variant, self.max_distance):
+                candidates = self.deletes.get(deleted)
+                if candidates is None:
+                    continue
+                if not isinstance(candidates, tuple):
+                    candidates = (candidates,)
+                for candidate in candidates:
+                    if bounded_distance(variant, candidate, self.max_distance) <= self.max_distance:
+                        return self.exact[candidate]
+        return None
+
+    def __contains__(self, password):
+        return self.match(password) is not None
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -40,6 +40,46 @@ PERMISSION_WEBMASTER = 255
 
 EMAIL_HTML_PERMISSION = PERMISSION_ADMIN
 
+PAGE_CACHE_TTL = 300 #Seconds to keep rendered pages that use set_template(..., cache_ttl=PAGE_CACHE_TTL)
+
+EMAIL_STATUS_QUEUED = 0
+
+EMAIL_STATUS_SENDING = 1
+
+EMAIL_STATUS_SENT = 2
+
+EMAIL_STATUS_FAILED = 3
+
+EMAIL_EVENT_QUEUED = 0
+
+EMAIL_EVENT_SENT = 1
+
+EMAIL_EVENT_DEFERRED = 2
+
+EMAIL_EVENT_FAILED = 3
+
+EMAIL_EVENT_OPENED = 4
+
+EMAIL_MAX_ATTEMPTS = 6
+
+EMAIL_RETRY_DELAY = 60 #Doubled after each failed attempt
+
+EMAIL_RETRY_MAX_DELAY = 3600
+
+EMAIL_CLAIM_TIMEOUT = 600 #Claimed emails are sent again if the worker hasn't finished by then
+
+EMAIL_KEEP_SENT = 604800
+
+EMAIL_ACCOUNT_LIMITS = {'default': [(20, 3600), (500, 86400)]} #(emails, seconds) for each sending account, set to the provider's limits (these are Gmail's)
+
+EMAIL_DOMAIN_LIMITS = {'*': [(60, 60), (1000, 3600)]} #(emails, seconds) for each recipient domain, "*" is used for any domain not listed
+
+EMAIL_OPEN_FLUSH_SIZE = 200 #Number of email opens to save at once
+
+EMAIL_OPEN_FLUSH_INTERVAL = 10 #Save email opens at least this often (in seconds) when there are any
+
+EMAIL_OPEN_MAX_PENDING = 50000 #Email opens to keep while the database can't be reached
+
 ACCEPT_REQUEST_WITH_NO_HEADERS = False #Should a POST request be blocked if it contains no origin or request headers? Disable if causing issues.
 
 #DATABASE_NAME = 'peter_pythontest'
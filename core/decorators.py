@@ -13,19 +13,28 @@
 
 from __future__ import absolute_import, division
 from functools import wraps
-from flask import redirect, url_for, abort, request, make_response, render_template
+from flask import redirect, url_for, abort, request, make_response, render_template, Response
 from werkzeug.routing import BuildError
 from werkzeug.http import HTTP_STATUS_CODES
 from werkzeug.exceptions import HTTPException
 import traceback
-import time
 
 from core.constants import *
 from core.session import SessionManager
 from core.tracking import *
+from extensions.html_minify import minify_page
+from extensions.page_cache import PAGE_CACHE
+from extensions.streaming import stream_template
     
 
-def set_template(template, status_code=200, mysql=None):
+def set_template(template, status_code=200, mysql=None, cache_ttl=None, cache_users=False, minify=None, stream=False):
+    """Render the dict returned by the page function with a template.
+    Set cache_ttl to keep the rendered page for that many seconds (see
+    extensions.page_cache), and cache_users to also cache it for logged in users.
+    The HTML is minified if HTML_MINIFY is set, unless minify says otherwise.
+    Set stream to send the page while it's rendered (see extensions.streaming),
+    which is for large pages that shouldn't be cached or minified.
+    """
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
@@ -56,15 +65,33 @@ def set_template(template, status_code=200, mysql=None):
                 mysql.command.log_status_code(status_code, kwargs['session']['group_id'])
             
             result['debug'] = {}
-            if not PRODUCTION_SERVER:
-                result['debug']['css_nocache'] = '?random={}'.format(int(time.time()))
-            
-            #Render the response
-            response = render_template(template,
-                                       get_data=request.args, post_data=request.form, session=kwargs.get('session', {}),
-                                       login_url=_get_redirect_url(func, _add_queries={'login': '1'}),
-                                       **result), status_code
-            return _add_response_headers(response)
+
+            #Render the response (minified before it's cached)
+            context = dict(get_data=request.args, post_data=request.form,
+                           login_url=_get_redirect_url(func, _add_queries={'login': '1'}),
+                           **result)
+            def render(session):
+                return minify_page(render_template(template, session=session, **context), minify)
+
+            session = kwargs.get('session')
+            #The session is saved once the page is sent, so the template can still change it
+            if stream:
+                on_close = session.defer_exit() if isinstance(session, SessionManager) else None
+                body = stream_template(template, on_close=on_close,
+                                       session=session if session is not None else {}, **context)
+                return _add_response_headers(Response(body, status_code, mimetype='text/html'))
+            cache_key = None
+            if cache_ttl:
+                cache_key = PAGE_CACHE.key(template, status_code, result, session, cache_users)
+            if cache_key is None:
+                body = render(session if session is not None else {})
+            else:
+                body = PAGE_CACHE.get(cache_key)
+                if body is None:
+                    body = render(PAGE_CACHE.punch(session) or {})
+                    PAGE_CACHE.set(cache_key, body, cache_ttl)
+                body = PAGE_CACHE.fill(body, session)
+            return _add_response_headers((body, status_code))
         return wrapper
     return decorator
     
@@ -181,9 +208,9 @@ def _add_response_headers(output):
     resp.headers['X-XSS-Protection'] = 1
     resp.headers['X-Content-Type-Options'] = 'nosniff'
     
-    #Disable caching
+    #Always check for changes (responses still have an ETag, so unchanged pages aren't sent again)
     if not PRODUCTION_SERVER:
-        resp.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+        resp.headers['Cache-Control'] = 'no-cache, must-revalidate'
         resp.headers['Pragma'] = 'no-cache'
         resp.headers['Expires'] = 0
         
@@ -4,44 +4,393 @@ from email.MIMEText import MIMEText
 from email.MIMEImage import MIMEImage
 from email.MIMEBase import MIMEBase
 from email import encoders
+from contextlib import contextmanager
 from ssl import SSLError
+import base64
+import hashlib
+import os
 import smtplib
+import socket
+import tempfile
+import threading
+import time
+import uuid
+try:
+    from Queue import LifoQueue, Empty
+except ImportError:
+    from queue import LifoQueue, Empty
 
 from extensions.html2text import html2text
 
-def form_message(sender, receivers, subject, body, attachments=[]):
-    """Create the email body with correctly formatted information."""
+def is_html(body):
+    return '<' in body and '>' in body
+
+
+class AttachmentCache(object):
+    """Keep base64 encoded copies of attachments on disk.
+    Each file is encoded once for as long as it's unchanged (going by the
+    path, modification time and size), and never held in memory all at once.
+    The output is the same as email.encoders.encode_base64.
+    """
+    #Multiple of the 57 bytes that make up each encoded line
+    READ_SIZE = 57 * 1024
+
+    #Multiple of the 77 bytes in each encoded line (including the newline)
+    CHUNK_SIZE = 77 * 1024
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, attachment):
+        """Get the path to the encoded file, encoding it if needed."""
+        stat = os.stat(attachment)
+        key = '{}:{}:{}'.format(os.path.abspath(attachment), stat.st_mtime, stat.st_size)
+        path = os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.b64')
+        if not os.path.exists(path):
+            self._encode(attachment, path)
+        return path
+
+    def _encode(self, attachment, path):
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+
+        #Write to a temporary file first so a half written file is never used
+        temp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.current_thread().ident)
+        last = b''
+        with open(attachment, 'rb') as source, open(temp_path, 'wb') as f:
+            encoded = b''
+            while True:
+                data = source.read(self.READ_SIZE)
+                if not data:
+                    break
+                last = data
+                f.write(encoded)
+                encoded = base64.encodestring(data)
 
+            #encode_base64 drops the final newline unless the data ends with one
+            if not last.endswith(b'\n'):
+                encoded = encoded[:-1]
+            f.write(encoded)
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            #Another process got there first
+            os.remove(temp_path)
+
+    def read(self, attachment):
+        with open(self.path(attachment), 'rb') as f:
+            return f.read()
+
+    def chunks(self, attachment):
+        """Read the encoded file in chunks that each end on a line break."""
+        with open(self.path(attachment), 'rb') as f:
+            while True:
+                chunk = f.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+
+ATTACHMENT_CACHE = AttachmentCache(os.path.join(tempfile.gettempdir(), 'email_attachments'))
+
+
+def _attachment_part(attachment, payload):
+    filename = attachment.replace('\\', '/').split('/')[-1]
+    part = MIMEBase('application', 'octet-stream')
+    part.set_payload(payload)
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.add_header('Content-Disposition', "attachment; filename={}".format(filename))
+    return part
+
+
+def attachment_parts(attachments):
+    """Create the encoded MIME part of each attachment."""
+    parts = []
+    for attachment in attachments:
+        try:
+            parts.append(_attachment_part(attachment, ATTACHMENT_CACHE.read(attachment)))
+        except (IOError, OSError):
+            print 'Failed to attach {}.'.format(attachment)
+    return parts
+
+
+class StreamedMessage(object):
+    """Formatted email where the attachments are read from ATTACHMENT_CACHE as it's sent.
+    Iterating over it gives the message in chunks, so sending a message
+    uses the same amount of memory whatever the size of the attachments.
+    """
+    def __init__(self, literals, attachments):
+        self.literals = literals
+        self.attachments = attachments
+
+    def __iter__(self):
+        yield self.literals[0]
+        for attachment, literal in zip(self.attachments, self.literals[1:]):
+            for chunk in ATTACHMENT_CACHE.chunks(attachment):
+                yield chunk
+            yield literal
+
+    def __str__(self):
+        return ''.join(self)
+
+    def sendmail(self, server, sender, recipients):
+        """Send the message over an smtplib.SMTP connection, like SMTP.sendmail.
+        Every chunk starts on a new line (or with a line break), so each one
+        can be dot-stuffed on its own.
+        """
+        server.ehlo_or_helo_if_needed()
+        code, response = server.mail(sender)
+        if code != 250:
+            server.rset()
+            raise smtplib.SMTPSenderRefused(code, response, sender)
+        refused = {}
+        for recipient in recipients:
+            code, response = server.rcpt(recipient)
+            if code not in (250, 251):
+                refused[recipient] = (code, response)
+        if len(refused) == len(recipients):
+            server.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        server.putcmd('data')
+        code, response = server.getreply()
+        if code != 354:
+            server.rset()
+            raise smtplib.SMTPDataError(code, response)
+        chunk = ''
+        for chunk in self:
+            server.send(smtplib.quotedata(chunk))
+        server.send('.' + smtplib.CRLF if chunk.endswith('\n') else smtplib.CRLF + '.' + smtplib.CRLF)
+        code, response = server.getreply()
+        if code != 250:
+            server.rset()
+            raise smtplib.SMTPDataError(code, response)
+        return refused
+
+
+def stream_message(sender, receivers, subject, body, attachments=[]):
+    """Create the email as a StreamedMessage.
+    The message is formatted with a placeholder for each attachment, which
+    is then split up so the encoded attachments can be inserted when sending.
+    """
     msg = MIMEMultipart('alternative')
     msg['To'] = ', '.join(receivers)
     msg['From'] = sender
-    msg['Subject'] = 'subject'
+    msg['Subject'] = subject
 
-    if '<' in body and '>' in body:
+    if is_html(body):
         msg.attach(MIMEText(html2text(body), 'plain'))
         msg.attach(MIMEText(body, 'html'))
     else:
         msg.attach(MIMEText(body, 'plain'))
 
+    found = []
+    slots = []
     for attachment in attachments:
         try:
-            with open(attachment, 'rb') as f:
-                filename = attachment.replace('\\', '/').split('/')[-1]
-                part = MIMEBase('application', 'octet-stream')
-                part.set_payload(f.read())
-                encoders.encode_base64(part)
-                part.add_header('Content-Disposition', "attachment; filename={}".format(filename))
-                msg.attach(part)
-        except IOError:
+            ATTACHMENT_CACHE.path(attachment)
+        except (IOError, OSError):
             print 'Failed to attach {}.'.format(attachment)
+            continue
+        slot = 'attachment{}'.format(uuid.uuid4().hex)
+        msg.attach(_attachment_part(attachment, slot))
+        found.append(attachment)
+        slots.append(slot)
+
+    literals = [msg.as_string()]
+    for slot in slots:
+        literals[-1:] = literals[-1].split(slot, 1)
+    return StreamedMessage(literals, found)
+
+
+def form_message(sender, receivers, subject, body, attachments=[]):
+    """Create the email body with correctly formatted information."""
+    return str(stream_message(sender, receivers, subject, body, attachments))
+
 
-    return msg.as_string()
+#Errors that mean the connection can't be used any more
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, socket.error, SSLError)
+
+
+class SMTPTransport(object):
+    """Send email over a pool of persistent SMTP connections.
+
+    Up to pool_size connections are opened (and logged in) as needed, and
+    are kept open between messages. An idle connection is checked with NOOP
+    before it is reused, and is closed once it has been idle for max_idle
+    seconds. If a connection drops in the middle of sending, a new one is
+    opened and the message is tried again.
+
+    Set smtp_class to use something other than smtplib (such as for testing).
+
+    Example usage:
+        transport = SMTPTransport('smtp.gmail.com', 465, username, password, ssl=True)
+        errors = transport.send_many([(sender, recipients, msg), ...])
+        transport.quit()
+    """
+    def __init__(self, host='localhost', port=0, username=None, password=None,
+                 ssl=False, starttls=False, pool_size=2, timeout=30,
+                 noop_after=10, max_idle=240, smtp_class=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.noop_after = noop_after
+        self.max_idle = max_idle
+        if smtp_class is None:
+            smtp_class = smtplib.SMTP_SSL if ssl else smtplib.SMTP
+        self.smtp_class = smtp_class
+        self.idle = LifoQueue()
+        self.slots = threading.BoundedSemaphore(pool_size)
+
+    def _connect(self):
+        server = self.smtp_class(self.host, self.port, timeout=self.timeout)
+        try:
+            server.ehlo()
+            if self.starttls:
+                server.starttls()
+                server.ehlo()
+            if self.username is not None:
+                server.login(self.username, self.password)
+        except Exception:
+            self._close(server)
+            raise
+        return server
+
+    def _close(self, server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException,) + CONNECTION_ERRORS:
+            server.close()
+
+    def _alive(self, server):
+        try:
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException,) + CONNECTION_ERRORS:
+            return False
+
+    def acquire(self):
+        """Get an open connection, waiting if the pool is fully in use."""
+        self.slots.acquire()
+        try:
+            while True:
+                try:
+                    server, last_used = self.idle.get_nowait()
+                except Empty:
+                    return self._connect()
+                idle_time = time.time() - last_used
+                if idle_time > self.max_idle or idle_time > self.noop_after and not self._alive(server):
+                    self._close(server)
+                    continue
+                return server
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, server, broken=False):
+        """Return a connection to the pool, or close it if it's broken."""
+        try:
+            if broken:
+                server.close()
+            else:
+                self.idle.put((server, time.time()))
+        finally:
+            self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        server = self.acquire()
+        try:
+            yield server
+        except CONNECTION_ERRORS:
+            self.release(server, broken=True)
+            raise
+        except Exception:
+            self.release(server)
+            raise
+        self.release(server)
+
+    def send(self, sender, recipients, msg):
+        """Send a single message, raising an error if it fails."""
+        error = self.send_many([(sender, recipients, msg)])[0]
+        if error is not None:
+            raise error
+
+    def send_many(self, messages):
+        """Send (sender, recipients, msg) tuples over one connection.
+        msg can be a string or a StreamedMessage.
+        Returns a list with either None or the error for each message.
+        """
+        results = []
+        remaining = list(messages)
+        reconnected = False
+        while remaining:
+            try:
+                with self.connection() as server:
+                    while remaining:
+                        sender, recipients, msg = remaining[0]
+                        try:
+                            if isinstance(msg, StreamedMessage):
+                                msg.sendmail(server, sender, recipients)
+                            else:
+                                server.sendmail(sender, recipients, msg)
+                            results.append(None)
+                        except CONNECTION_ERRORS:
+                            raise
+                        except smtplib.SMTPException as e:
+                            results.append(e)
+                        remaining.pop(0)
+                        reconnected = False
+
+            #Try once more with a new connection, otherwise fail what's left
+            except (smtplib.SMTPException,) + CONNECTION_ERRORS as e:
+                if reconnected:
+                    results.extend(e for _ in remaining)
+                    break
+                reconnected = True
+        return results
+
+    def quit(self):
+        """Close every idle connection."""
+        while True:
+            try:
+                server, last_used = self.idle.get_nowait()
+            except Empty:
+                break
+            self._close(server)
+
+
+_TRANSPORTS = {}
+
+_TRANSPORTS_LOCK = threading.Lock()
+
+
+def get_transport(host='localhost', port=0, username=None, password=None, **kwargs):
+    """Get a transport shared by everything sending from the same account."""
+    key = (host, port, username)
+    with _TRANSPORTS_LOCK:
+        if key not in _TRANSPORTS:
+            _TRANSPORTS[key] = SMTPTransport(host, port, username, password, **kwargs)
+        return _TRANSPORTS[key]
+
+
+def close_transports():
+    with _TRANSPORTS_LOCK:
+        for transport in _TRANSPORTS.values():
+            transport.quit()
 
 
 class Mail(object):
     """Easily send email with attachments.
     
-    Use the Mail.replace() option for
+    Use the Mail.replace() option for any text that needs filling in, or
+    core.mail_merge.MailTemplate to send a personalised copy to many people.
     
     Example usage:
         mail = Mail('Email Subject', html_body)
@@ -55,10 +404,22 @@ class Mail(object):
     def __init__(self, subject, body, attachments=None):            
         self.subject = subject
         self.body = body
-        self.attachments = []
+        self.attachments = list(attachments or [])
         self.replacements = {}
         self.recipients = []
 
+    def _replace(self, text):
+        """Apply the replacements, longest first so one can't break another."""
+        for value in sorted(self.replacements, key=len, reverse=True):
+            text = text.replace(value, self.replacements[value])
+        return text
+
+    def _form_message(self, sender, recipients):
+        return form_message(sender, recipients, self._replace(self.subject), self._replace(self.body), self.attachments)
+
+    def _stream_message(self, sender, recipients):
+        return stream_message(sender, recipients, self._replace(self.subject), self._replace(self.body), self.attachments)
+
     def add_recipient(self, email, name=None):
         if name is not None:
             self.recipients.append('{} <{}>'.format(name, email))
@@ -71,18 +432,24 @@ class Mail(object):
     def replace(self, value, replacement):
         self.replacements[value] = replacement
 
+    def enqueue(self, queue, sender, account='default', tracking_id=None):
+        """Add the email to a core.email_queue.EmailQueue to be sent by the worker.
+        Returns the tracking ID.
+        """
+        msg = self._form_message(sender, self.recipients)
+        return queue.enqueue(sender, self.recipients, msg, account=account, tracking_id=tracking_id)
+
     def send_with_papercut(self):
         """Send email with the papercut program (for local testing)."""
         sender = 'Papercut@Papercut.com'
         recipients = ['Papercut@user.com']
 
-        msg = form_message(sender, recipients, self.subject, self.body, self.attachments)
+        msg = self._stream_message(sender, recipients)
         try:
-            server = smtplib.SMTP('localhost')
-            server.sendmail(sender, recipients, msg)
+            get_transport('localhost').send(sender, recipients, msg)
             return True
             
-        except smtplib.SMTPException as e:
+        except (smtplib.SMTPException,) + CONNECTION_ERRORS as e:
             print 'Error: {}'.format(e)
             
         return False
@@ -95,12 +462,9 @@ class Mail(object):
         Google Apps: 2000 emails per day
         """
         
-        msg = form_message(username, self.recipients, self.subject, self.body, self.attachments)
+        msg = self._stream_message(username, self.recipients)
         try:
-            server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-            server.ehlo()
-            server.login(username, password)
-            server.sendmail(username, self.recipients, msg)
+            get_transport('smtp.gmail.com', 465, username, password, ssl=True).send(username, self.recipients, msg)
             return True
             
         except smtplib.SMTPAuthenticationError:
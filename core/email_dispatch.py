@@ -0,0 +1,204 @@
+#Send batches of email in parallel while keeping under provider rate limits
+#Mail is grouped by sender account and recipient domain, each group is sent
+#on its own thread, and anything over a limit is deferred to when it allows.
+from __future__ import absolute_import, division
+import smtplib
+import threading
+import time
+from email.utils import parseaddr
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+from core.email import CONNECTION_ERRORS
+
+
+#Limits as (emails, seconds), from the send_with_gmail docstring
+GMAIL_LIMITS = [(20, 3600), (500, 86400)]
+
+GOOGLE_APPS_LIMITS = [(2000, 86400)]
+
+
+class TokenBucket(object):
+    """Allow up to "count" uses every "seconds", refilling gradually.
+
+    >>> bucket = TokenBucket(2, 60, clock=lambda: 0)
+    >>> bucket.take(), bucket.take(), bucket.take()
+    (True, True, False)
+    >>> bucket.delay()
+    30.0
+    """
+    def __init__(self, count, seconds, clock=time.time):
+        self.capacity = float(count)
+        self.rate = count / seconds
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+        #When the tokens for any deferred uses will have refilled
+        self.booked = 0.0
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, count=1):
+        """Get the number of seconds until "count" tokens are available."""
+        self._refill()
+        count = min(count, self.capacity)
+        return max(0.0, (count - self.tokens) / self.rate)
+
+    def take(self, count=1):
+        if self.delay(count):
+            return False
+        self.tokens -= min(count, self.capacity)
+        return True
+
+
+def recipient_domain(recipient):
+    """Get the domain of an address.
+
+    >>> recipient_domain('Name <Name@Example.com>')
+    'example.com'
+    """
+    return parseaddr(recipient)[1].rsplit('@', 1)[-1].lower()
+
+
+def recipient_domains(recipients):
+    """Get each domain in a list of addresses once.
+
+    >>> recipient_domains(['a@example.com', 'B <b@Example.org>', 'c@example.com'])
+    ('example.com', 'example.org')
+    """
+    return tuple(sorted(set(recipient_domain(recipient) for recipient in recipients)))
+
+
+class Dispatcher(object):
+    """Send messages through the transport of each account.
+
+    Limits are lists of (emails, seconds) for each account or domain, and
+    every message uses one token per recipient from its account's limits
+    and one from the limits of each domain it's sent to. Domains that
+    aren't listed use the limits under "*", if there are any. The buckets
+    are kept in memory, so each worker process has its own.
+
+    Example usage:
+        dispatcher = Dispatcher({'gmail': transport}, account_limits={'gmail': GMAIL_LIMITS},
+                                domain_limits={'*': [(60, 60)]})
+        sent, failed, deferred = dispatcher.dispatch(messages)
+    """
+    def __init__(self, transports, account_limits=None, domain_limits=None, threads=4):
+        self.transports = transports
+        self.account_limits = account_limits or {}
+        self.domain_limits = domain_limits or {}
+        self.threads = threads
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def _buckets(self, kind, name, limits):
+        key = (kind, name)
+        if key not in self.buckets:
+            self.buckets[key] = [TokenBucket(count, seconds) for count, seconds in limits.get(name, limits.get('*', ()))]
+        return self.buckets[key]
+
+    def _needed(self, account, domains, recipients):
+        """Get (bucket, tokens) for each limit a message uses."""
+        needed = [(bucket, recipients) for bucket in self._buckets('account', account, self.account_limits)]
+        for domain in domains:
+            needed += [(bucket, 1) for bucket in self._buckets('domain', domain, self.domain_limits)]
+        return needed
+
+    def reserve(self, account, domains, recipients):
+        """Take the tokens needed to send a message.
+        Returns 0 if the message can be sent, or the seconds to wait if not.
+        Nothing is taken unless every limit allows it.
+        """
+        with self.lock:
+            needed = self._needed(account, domains, recipients)
+            delay = max([bucket.delay(count) for bucket, count in needed] or [0])
+            if delay:
+                return delay
+            for bucket, count in needed:
+                bucket.take(count)
+            return 0
+
+    def schedule(self, account, domains, recipients, delay):
+        """Get the seconds to defer a message over the limits by.
+        Each deferred message is booked after the ones before it, at the
+        rate the limits refill, so they don't all come back at once.
+        """
+        with self.lock:
+            now = time.time()
+            needed = self._needed(account, domains, recipients)
+            start = max([now + delay] + [bucket.booked for bucket, count in needed])
+            for bucket, count in needed:
+                bucket.booked = start + min(count, bucket.capacity) / bucket.rate
+            return start - now
+
+    def _send_group(self, account, domains, messages, results):
+        sent, failed, deferred = results
+        transport = self.transports.get(account)
+        if transport is None:
+            error = KeyError('no transport for account {}'.format(account))
+            failed.extend((message, error) for message in messages)
+            return
+
+        allowed = []
+        for i, message in enumerate(messages):
+            delay = self.reserve(account, domains, len(message[3]))
+            if delay:
+                #The rest would be refused too, so don't use up any more tokens
+                deferred.extend((remaining, self.schedule(account, domains, len(remaining[3]), delay))
+                                for remaining in messages[i:])
+                break
+            allowed.append(message)
+        if not allowed:
+            return
+
+        try:
+            errors = transport.send_many([message[2:] for message in allowed])
+        except (smtplib.SMTPException,) + CONNECTION_ERRORS as e:
+            errors = [e] * len(allowed)
+        for message, error in zip(allowed, errors):
+            if error is None:
+                sent.append(message)
+            else:
+                failed.append((message, error))
+
+    def dispatch(self, messages):
+        """Send (id, account, sender, recipients, msg) tuples.
+        Returns the sent messages, a list of (message, error) for any that
+        failed, and a list of (message, seconds) for any over the limits.
+        """
+        groups = {}
+        for message in messages:
+            key = (message[1], recipient_domains(message[3]))
+            groups.setdefault(key, []).append(message)
+
+        work = Queue()
+        for key, group in groups.items():
+            work.put((key, group))
+
+        #Appending to a list is thread safe, so the threads can share the results
+        results = ([], [], [])
+
+        def worker():
+            while True:
+                try:
+                    (account, domains), group = work.get_nowait()
+                except Empty:
+                    return
+                self._send_group(account, domains, group, results)
+
+        threads = [threading.Thread(target=worker) for _ in range(min(self.threads, len(groups)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
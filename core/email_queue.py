@@ -0,0 +1,224 @@
+#Send email in the background instead of during the request
+#Requests add messages to the email_queue table, and a worker (run with
+#"python -m core.email_queue") claims them in batches and sends them.
+#The tables are in EMAIL_QUEUE_SCHEMA, and create_tables() creates them or
+#adds any missing columns and indexes (the worker runs it when it starts).
+from __future__ import absolute_import
+import smtplib
+import time
+import uuid
+
+from core.constants import *
+from core.email_dispatch import Dispatcher
+
+
+#(column, definition) for each table, in order
+EMAIL_QUEUE_SCHEMA = {
+    'email_queue': [
+        ('id', 'INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY'),
+        ('tracking_id', 'CHAR(32) NOT NULL'),
+        ('account', "VARCHAR(64) NOT NULL DEFAULT 'default'"),
+        ('sender', 'VARCHAR(255) NOT NULL'),
+        ('recipients', 'TEXT NOT NULL'),
+        ('message', 'LONGTEXT NOT NULL'),
+        ('status', 'TINYINT UNSIGNED NOT NULL DEFAULT 0'),
+        ('attempts', 'SMALLINT UNSIGNED NOT NULL DEFAULT 0'),
+        ('next_attempt', 'INT UNSIGNED NOT NULL DEFAULT 0'),
+        ('claim_token', 'CHAR(32) NULL'),
+        ('claimed_at', 'INT UNSIGNED NULL'),
+        ('created', 'INT UNSIGNED NOT NULL DEFAULT 0'),
+        ('last_error', 'VARCHAR(255) NULL'),
+    ],
+    'email_history': [
+        ('id', 'INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY'),
+        ('queue_id', 'INT UNSIGNED NULL'),
+        ('tracking_id', 'CHAR(32) NOT NULL'),
+        ('event', 'TINYINT UNSIGNED NOT NULL'),
+        ('details', 'VARCHAR(255) NULL'),
+        ('time', 'INT UNSIGNED NOT NULL'),
+    ],
+}
+
+#(table, index name, columns)
+EMAIL_QUEUE_INDEXES = [
+    ('email_queue', 'email_queue_ready', 'status, next_attempt'),
+    ('email_queue', 'email_queue_claim', 'claim_token'),
+    ('email_queue', 'email_queue_tracking', 'tracking_id'),
+    ('email_history', 'email_history_tracking', 'tracking_id, event'),
+]
+
+
+def create_tables(sql_exec):
+    """Create the queue tables, or add anything missing to existing ones."""
+    for table, columns in EMAIL_QUEUE_SCHEMA.items():
+        sql_exec('CREATE TABLE IF NOT EXISTS {} ({})'.format(
+            table, ', '.join('{} {}'.format(name, definition) for name, definition in columns)))
+        existing = set(row[0] for row in sql_exec('SELECT COLUMN_NAME FROM information_schema.COLUMNS'
+                                                  ' WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s', table))
+        for name, definition in columns:
+            if name not in existing:
+                sql_exec('ALTER TABLE {} ADD COLUMN {} {}'.format(table, name, definition))
+
+    for table, index, columns in EMAIL_QUEUE_INDEXES:
+        if not sql_exec('SELECT INDEX_NAME FROM information_schema.STATISTICS'
+                        ' WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s', table, index):
+            sql_exec('CREATE INDEX {} ON {} ({})'.format(index, table, columns))
+
+
+def retry_delay(attempts):
+    """Get the number of seconds to wait before the next attempt.
+
+    >>> [retry_delay(i) for i in range(1, 5)]
+    [60, 120, 240, 480]
+    """
+    return min(EMAIL_RETRY_MAX_DELAY, EMAIL_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def is_permanent_error(error):
+    """Check if an error means the email will never send, such as an invalid address."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, message in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+class EmailQueue(object):
+    """Add emails to the queue and record what happens to them."""
+
+    def __init__(self, sql_exec):
+        self.sql = sql_exec
+
+    def enqueue(self, sender, recipients, msg, account='default', tracking_id=None, send_at=None):
+        """Add a formatted message to the queue.
+        Returns the tracking ID, which can be used to find it in the history.
+        """
+        if tracking_id is None:
+            tracking_id = uuid.uuid4().hex
+        queue_id = self.sql('INSERT INTO email_queue (tracking_id, account, sender, recipients, message, status, attempts, next_attempt, created)'
+                            ' VALUES (%s, %s, %s, %s, %s, %s, 0, %s, UNIX_TIMESTAMP(NOW()))',
+                            tracking_id, account, sender, '\n'.join(recipients), msg,
+                            EMAIL_STATUS_QUEUED, int(send_at or time.time()))
+        self.record([(queue_id, tracking_id, EMAIL_EVENT_QUEUED, None)])
+        return tracking_id
+
+    def record(self, events):
+        """Add (queue_id, tracking_id, event, details) rows to the history in one insert."""
+        if not events:
+            return
+        values = []
+        for event in events:
+            values.extend(event)
+        self.sql('INSERT INTO email_history (queue_id, tracking_id, event, details, time) VALUES {}'.format(
+                 ', '.join(['(%s, %s, %s, %s, UNIX_TIMESTAMP(NOW()))'] * len(events))), *values)
+
+    def claim(self, batch_size):
+        """Lock a batch of emails that are ready to send.
+        Emails claimed by a worker that never finished are claimed again.
+        The claim is a single UPDATE, so two workers can never get the same row.
+        """
+        claim_token = uuid.uuid4().hex
+        claimed = self.sql('UPDATE email_queue SET status = %s, claim_token = %s, claimed_at = UNIX_TIMESTAMP(NOW())'
+                           ' WHERE (status = %s AND next_attempt <= UNIX_TIMESTAMP(NOW()))'
+                           ' OR (status = %s AND claimed_at < UNIX_TIMESTAMP(NOW()) - %s)'
+                           ' ORDER BY next_attempt LIMIT %s',
+                           EMAIL_STATUS_SENDING, claim_token, EMAIL_STATUS_QUEUED,
+                           EMAIL_STATUS_SENDING, EMAIL_CLAIM_TIMEOUT, batch_size)
+        if not claimed:
+            return []
+        return self.sql('SELECT id, tracking_id, account, sender, recipients, message, attempts'
+                        ' FROM email_queue WHERE claim_token = %s ORDER BY id', claim_token)
+
+    def mark_sent(self, rows):
+        if not rows:
+            return
+        ids = [row[0] for row in rows]
+        self.sql('UPDATE email_queue SET status = %s, attempts = attempts + 1, claim_token = NULL, last_error = NULL'
+                 ' WHERE id IN ({})'.format(', '.join(['%s'] * len(ids))), EMAIL_STATUS_SENT, *ids)
+        self.record([(row[0], row[1], EMAIL_EVENT_SENT, None) for row in rows])
+
+    def mark_failed(self, row, error):
+        """Schedule another attempt, or give up if the error is permanent or there were too many attempts."""
+        queue_id, tracking_id, attempts = row[0], row[1], row[6] + 1
+        details = '{}: {}'.format(type(error).__name__, error)[:255]
+        if attempts >= EMAIL_MAX_ATTEMPTS or is_permanent_error(error):
+            self.sql('UPDATE email_queue SET status = %s, attempts = %s, claim_token = NULL, last_error = %s WHERE id = %s',
+                     EMAIL_STATUS_FAILED, attempts, details, queue_id)
+            self.record([(queue_id, tracking_id, EMAIL_EVENT_FAILED, details)])
+        else:
+            self.sql('UPDATE email_queue SET status = %s, attempts = %s, next_attempt = %s, claim_token = NULL, last_error = %s WHERE id = %s',
+                     EMAIL_STATUS_QUEUED, attempts, int(time.time()) + retry_delay(attempts), details, queue_id)
+            self.record([(queue_id, tracking_id, EMAIL_EVENT_DEFERRED, details)])
+
+    def defer(self, rows):
+        """Put (row, seconds) back in the queue without counting it as an attempt.
+        Nothing is added to the history, as this happens often when sending to many people.
+        """
+        if not rows:
+            return
+        now = time.time()
+        values = []
+        for row, delay in rows:
+            values.extend((row[0], int(now + delay + 1)))
+        ids = [row[0] for row, delay in rows]
+        self.sql('UPDATE email_queue SET status = %s, claim_token = NULL, next_attempt = CASE id {} END'
+                 ' WHERE id IN ({})'.format(' '.join(['WHEN %s THEN %s'] * len(rows)), ', '.join(['%s'] * len(ids))),
+                 EMAIL_STATUS_QUEUED, *(values + ids))
+
+
+class EmailWorker(object):
+    """Send queued emails through the transport for each account.
+    Rate limits are passed on to core.email_dispatch.Dispatcher, and when run
+    as a script the worker uses EMAIL_ACCOUNT_LIMITS and EMAIL_DOMAIN_LIMITS.
+
+    Example usage:
+        worker = EmailWorker(mysql.sql, {'default': get_transport('localhost')})
+        worker.run()
+    """
+
+    def __init__(self, sql_exec, transports, batch_size=50, interval=5,
+                 account_limits=None, domain_limits=None, threads=4):
+        self.queue = EmailQueue(sql_exec)
+        self.transports = transports
+        self.dispatcher = Dispatcher(transports, account_limits, domain_limits, threads)
+        self.batch_size = batch_size
+        self.interval = interval
+
+    def process_batch(self):
+        """Send one batch of emails, returning how many were sent or failed.
+        Deferred emails aren't counted, as they can't be claimed again until
+        the limits allow them.
+        """
+        rows = self.queue.claim(self.batch_size)
+        if not rows:
+            return 0
+        rows_by_id = dict((row[0], row) for row in rows)
+        messages = [(row[0], row[2], row[3], row[4].split('\n'), row[5]) for row in rows]
+
+        #The database connection isn't thread safe, so only update it after sending
+        sent, failed, deferred = self.dispatcher.dispatch(messages)
+        for message, error in failed:
+            self.queue.mark_failed(rows_by_id[message[0]], error)
+        self.queue.defer([(rows_by_id[message[0]], delay) for message, delay in deferred])
+        self.queue.mark_sent([rows_by_id[message[0]] for message in sent])
+        return len(sent) + len(failed)
+
+    def run(self):
+        """Keep sending emails, waiting between checks when nothing could be sent."""
+        try:
+            while True:
+                if not self.process_batch():
+                    time.sleep(self.interval)
+        finally:
+            for transport in self.transports.values():
+                transport.quit()
+
+
+if __name__ == '__main__':
+    from core.database import DatabaseConnection
+    from core.email import get_transport
+
+    connection = DatabaseConnection(DATABASE_HOST, DATABASE_NAME, DATABASE_USER, DATABASE_PASSWORD)
+    create_tables(connection.sql)
+    EmailWorker(connection.sql, {'default': get_transport('localhost')},
+                account_limits=EMAIL_ACCOUNT_LIMITS, domain_limits=EMAIL_DOMAIN_LIMITS).run()
@@ -0,0 +1,140 @@
+#Send a personalised copy of the same email to many recipients
+#The template is turned into a list of fixed strings and fields once, so each
+#recipient only costs a join, instead of a full form_message and html2text.
+from __future__ import absolute_import
+import binascii
+import re
+import uuid
+from email.header import Header
+from email.MIMEMultipart import MIMEMultipart
+from email.MIMEText import MIMEText
+from email.utils import formataddr, parseaddr
+
+from core.email import attachment_parts, is_html
+from extensions.html2text import html2text
+
+
+class MergePlan(object):
+    """Text split into the fixed parts and the fields between them.
+    Longer fields are matched first, and missing values are left as they are.
+
+    >>> plan = MergePlan('Hi {name}, {name_full}!', ['{name}', '{name_full}'])
+    >>> plan.render({'{name}': 'Bob', '{name_full}': 'Bob Smith'})
+    'Hi Bob, Bob Smith!'
+    >>> plan.render({})
+    'Hi {name}, {name_full}!'
+    """
+    def __init__(self, text, fields):
+        fields = sorted(set(fields), key=len, reverse=True)
+        if fields:
+            parts = re.split('({})'.format('|'.join(re.escape(i) for i in fields)), text)
+        else:
+            parts = [text]
+        self.literals = parts[::2]
+        self.fields = parts[1::2]
+
+    def render(self, values):
+        result = [self.literals[0]]
+        for field, literal in zip(self.fields, self.literals[1:]):
+            result.append(values.get(field, field))
+            result.append(literal)
+        return ''.join(result)
+
+
+def _is_ascii(text):
+    try:
+        text.encode('ascii') if not isinstance(text, bytes) else text.decode('ascii')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return False
+    return True
+
+
+def encode_header(value):
+    if _is_ascii(value):
+        return value
+    return Header(value, 'utf-8').encode()
+
+
+def encode_address(address):
+    name, email = parseaddr(address)
+    return formataddr((encode_header(name), email))
+
+
+def encode_body(text):
+    """Encode text as quoted-printable UTF-8."""
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    encoded = binascii.b2a_qp(text, False, True)
+    return encoded if isinstance(encoded, str) else encoded.decode('ascii')
+
+
+class MailTemplate(object):
+    """Email with fields that are filled in for each recipient.
+
+    The MIME structure (including encoded attachments) is built once with
+    placeholders for the recipient, subject and text parts, and the subject
+    and text parts are compiled into MergePlans. The plain text part comes
+    from running html2text on the template, so fields inside HTML tags or
+    attributes only appear in the HTML part. Values are inserted as given.
+
+    Example usage:
+        template = MailTemplate('Hi {name}', html_body, ['{name}', '{link}'])
+        for address, values in recipients:
+            transport.send(sender, [address], template.render(sender, address, values))
+    """
+    def __init__(self, subject, body, fields, attachments=()):
+        self.fields = list(fields)
+        self.subject = MergePlan(subject, self.fields)
+        if is_html(body):
+            self.parts = [MergePlan(html2text(body), self.fields), MergePlan(body, self.fields)]
+            subtypes = ['plain', 'html']
+        else:
+            self.parts = [MergePlan(body, self.fields)]
+            subtypes = ['plain']
+
+        #Build the message with placeholders, then split it up like the text
+        token = uuid.uuid4().hex[:12]
+        self.slot_from = 'mergefrom{}'.format(token)
+        self.slot_to = 'mergeto{}'.format(token)
+        self.slot_subject = 'mergesubject{}'.format(token)
+        self.slot_parts = ['mergepart{}{}'.format(token, i) for i in range(len(self.parts))]
+
+        msg = MIMEMultipart('alternative')
+        msg['To'] = self.slot_to
+        msg['From'] = self.slot_from
+        msg['Subject'] = self.slot_subject
+        for subtype, slot in zip(subtypes, self.slot_parts):
+            part = MIMEText('', subtype)
+            part.set_param('charset', 'utf-8')
+            del part['Content-Transfer-Encoding']
+            part['Content-Transfer-Encoding'] = 'quoted-printable'
+            part.set_payload(slot)
+            msg.attach(part)
+        for part in attachment_parts(attachments):
+            msg.attach(part)
+
+        slots = [self.slot_from, self.slot_to, self.slot_subject] + self.slot_parts
+        self.message = MergePlan(msg.as_string(), slots)
+
+    def render(self, sender, recipient, values):
+        """Create the full message for one recipient."""
+        slots = {
+            self.slot_from: encode_address(sender),
+            self.slot_to: encode_address(recipient),
+            self.slot_subject: encode_header(self.subject.render(values)),
+        }
+        for slot, part in zip(self.slot_parts, self.parts):
+            slots[slot] = encode_body(part.render(values))
+        return self.message.render(slots)
+
+    def enqueue(self, queue, sender, recipients, account='default'):
+        """Add a copy for each (address, values) to a core.email_queue.EmailQueue.
+        Returns the tracking IDs.
+        """
+        return [queue.enqueue(sender, [address], self.render(sender, address, values), account=account)
+                for address, values in recipients]
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
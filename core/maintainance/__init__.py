@@ -5,4 +5,5 @@ from core.maintainance.database import *
 
 def clean_database(connection):
     print 'Cleaned old sessions: {}'.format(remove_old_sessions(connection.sql))
-    print 'Cleaned login attempts: {}'.format(remove_login_attempts(connection.sql))
\ No newline at end of file
+    print 'Cleaned login attempts: {}'.format(remove_login_attempts(connection.sql))
+    print 'Cleaned sent emails: {}'.format(remove_sent_emails(connection.sql))
\ No newline at end of file
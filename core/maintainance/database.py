@@ -1,6 +1,6 @@
 from __future__ import absolute_import
 
-from core.constants import BAN_TIME_IP, BAN_TIME_ACCOUNT
+from core.constants import BAN_TIME_IP, BAN_TIME_ACCOUNT, EMAIL_KEEP_SENT, EMAIL_STATUS_SENT, EMAIL_STATUS_FAILED
 from core.session import SESSION_TIMEOUT
 
 
@@ -11,4 +11,8 @@ def remove_old_sessions(sql_execute):
     
     
 def remove_login_attempts(sql_execute):
-    return sql_execute('DELETE FROM login_attempts WHERE attempt_time < UNIX_TIMESTAMP(NOW()) - {}'.format(max(MIN_TIMEOUT, BAN_TIME_IP, BAN_TIME_ACCOUNT)))
\ No newline at end of file
+    return sql_execute('DELETE FROM login_attempts WHERE attempt_time < UNIX_TIMESTAMP(NOW()) - {}'.format(max(MIN_TIMEOUT, BAN_TIME_IP, BAN_TIME_ACCOUNT)))
+
+
+def remove_sent_emails(sql_execute):
+    return sql_execute('DELETE FROM email_queue WHERE status IN ({}, {}) AND claimed_at < UNIX_TIMESTAMP(NOW()) - {}'.format(EMAIL_STATUS_SENT, EMAIL_STATUS_FAILED, EMAIL_KEEP_SENT))
\ No newline at end of file
@@ -21,6 +21,7 @@ class SessionManager(object):
     def __init__(self, db_connection):
         self.sql = db_connection.sql
         self.skip = False
+        self.deferred = False
                 
     def __enter__(self):
         self._session_start()
@@ -163,6 +164,17 @@ class SessionManager(object):
                 return session_id
     
     def __exit__(self, *args):
+        if not self.deferred:
+            self.save()
+    
+    def defer_exit(self):
+        """Keep the session open after the page function returns, for streamed pages.
+        Returns the function that saves it, to call once the page is sent.
+        """
+        self.deferred = True
+        return self.save
+    
+    def save(self):
         self._track_continue()
         data = cPickle.dumps(self.data)
         data_len = len(data)
@@ -1,9 +1,27 @@
 from __future__ import absolute_import
-from flask import request
+from flask import request, Response
+from collections import OrderedDict
+import atexit
+import base64
+import os
+import threading
+import time
+import traceback
 
+from core.constants import *
 from core.hash import quick_hash
 
 
+#Transparent 1x1 GIF
+TRACKING_GIF = base64.b64decode(b'R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7')
+
+TRACKING_HEADERS = [
+    ('Cache-Control', 'no-cache, no-store, must-revalidate, private, max-age=0'),
+    ('Pragma', 'no-cache'),
+    ('Expires', '0'),
+]
+
+
 def get_ip():
     return request.headers.get('X-Forwarded-For', request.remote_addr)
     
@@ -94,3 +112,148 @@ def get_url_id(sql_exec):
         id = sql_exec('INSERT INTO urls (url) VALUES (%s)', url)
         #id = sql_exec('INSERT INTO urls (url, first_visit, last_visit, total_visits) VALUES (%s, UNIX_TIMESTAMP(NOW()), UNIX_TIMESTAMP(NOW()), 1)', url)
     return id
+
+
+def tracking_pixel():
+    """Create a response with the tracking image, that won't be cached anywhere."""
+    return Response(TRACKING_GIF, mimetype='image/gif', headers=TRACKING_HEADERS)
+
+
+class EmailOpenBuffer(object):
+    """Record email opens in email_history, saving them in batches.
+
+    Opens are kept in memory until flush_size of them are waiting or
+    flush_interval seconds have passed, and are then saved with one insert.
+    A background thread saves them on time even when no more opens come
+    in, and anything left is saved when the process exits.
+    Each tracking ID is only recorded once. The most recent IDs are
+    remembered so repeated opens are ignored straight away, and the rest
+    are checked against the history when saving.
+
+    If saving fails, the opens are kept to try again, up to max_pending of
+    them (the oldest are dropped after that). Errors are printed instead of
+    raised, so the tracking image is always sent.
+
+    Database connections can't be shared between threads, so connect is
+    called to open one just for saving opens (in each process), and
+    should return its sql function.
+
+    Example usage:
+        email_opens = EmailOpenBuffer(lambda: DatabaseConnection(host, database, user, password).sql)
+
+        @app.route('/tracking/email/<string:id>.gif')
+        def email_tracking(id):
+            email_opens.add(id)
+            return tracking_pixel()
+    """
+    def __init__(self, connect, flush_size=EMAIL_OPEN_FLUSH_SIZE, flush_interval=EMAIL_OPEN_FLUSH_INTERVAL,
+                 seen_size=100000, max_pending=EMAIL_OPEN_MAX_PENDING):
+        self.connect = connect
+        self.sql = None
+        self.sql_pid = None
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.seen_size = seen_size
+        self.max_pending = max_pending
+        self.seen = OrderedDict()
+        self.pending = []
+        self.last_flush = time.time()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.pid = None
+        atexit.register(self.close)
+
+    def _start(self):
+        """Start the thread that saves opens on time (again after a fork, as threads aren't copied)."""
+        if self.pid == os.getpid() or self.stopped.is_set():
+            return
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self._run, name='EmailOpenBuffer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.flush_interval):
+            if self.pending and time.time() - self.last_flush >= self.flush_interval:
+                self.flush(raise_errors=False)
+
+    def _limit(self):
+        """Drop the oldest opens over max_pending, so they can be recorded again later."""
+        excess = len(self.pending) - self.max_pending
+        if excess > 0:
+            for tracking_id, opened in self.pending[:excess]:
+                self.seen.pop(tracking_id, None)
+            del self.pending[:excess]
+
+    def add(self, tracking_id):
+        """Record that an email was opened."""
+        now = time.time()
+        with self.lock:
+            if tracking_id in self.seen:
+                return
+            self.seen[tracking_id] = None
+            while len(self.seen) > self.seen_size:
+                self.seen.popitem(last=False)
+            self.pending.append((tracking_id, int(now)))
+            self._limit()
+            self._start()
+            due = len(self.pending) >= self.flush_size or now - self.last_flush >= self.flush_interval
+        if due:
+            self.flush(raise_errors=False)
+
+    def flush(self, raise_errors=True):
+        """Save the waiting opens, returning how many were new."""
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+                self.last_flush = time.time()
+            if not pending:
+                return 0
+
+            try:
+                return self._save(pending)
+            except Exception:
+                with self.lock:
+                    self.pending[:0] = pending
+                    self._limit()
+                if raise_errors:
+                    raise
+                traceback.print_exc()
+                return 0
+
+    def close(self):
+        """Stop the background thread and save anything left."""
+        self.stopped.set()
+        if self.thread is not None and self.pid == os.getpid():
+            self.thread.join()
+        self.flush(raise_errors=False)
+
+    def _connection(self):
+        """Get the sql function to save with, connecting again after a fork.
+        This is only used while flush_lock is held.
+        """
+        if self.sql is None or self.sql_pid != os.getpid():
+            self.sql = self.connect()
+            self.sql_pid = os.getpid()
+        return self.sql
+
+    def _save(self, pending):
+        sql = self._connection()
+
+        #Skip anything recorded before this process started, or by another process
+        ids = [tracking_id for tracking_id, opened in pending]
+        recorded = sql('SELECT tracking_id FROM email_history WHERE event = %s AND tracking_id IN ({})'.format(
+                            ', '.join(['%s'] * len(ids))), EMAIL_EVENT_OPENED, *ids)
+        recorded = set(row[0] for row in recorded)
+        pending = [(tracking_id, opened) for tracking_id, opened in pending if tracking_id not in recorded]
+        if not pending:
+            return 0
+
+        values = []
+        for tracking_id, opened in pending:
+            values.extend((tracking_id, tracking_id, EMAIL_EVENT_OPENED, opened))
+        sql('INSERT INTO email_history (queue_id, tracking_id, event, details, time) VALUES {}'.format(
+                 ', '.join(['((SELECT id FROM email_queue WHERE tracking_id = %s LIMIT 1), %s, %s, NULL, %s)'] * len(pending))), *values)
+        return len(pending)
@@ -5,6 +5,7 @@ import re
 import os
 from functools import wraps
 
+from core.common_passwords import CommonPasswordIndex
 from settings import APP_STATIC
 
 
@@ -193,6 +194,9 @@ def validate_email(email, _error_ids):
 with open(os.path.join(APP_STATIC, 'used_passwords.txt'), 'r') as f:
     COMMON_PASSWORDS = set(f.read().split('\n'))
 
+#Catches variants such as "P@ssw0rd1!" that aren't in the list
+COMMON_PASSWORD_INDEX = CommonPasswordIndex(COMMON_PASSWORDS)
+
 
 @validate_prepare
 @validate_length(PASSWORD_MIN_LENGTH, PASSWORD_MAX_LENGTH)
@@ -200,7 +204,7 @@ with open(os.path.join(APP_STATIC, 'used_passwords.txt'), 'r') as f:
 @validate_unique(PASSWORD_REQUIRED_UNIQUE)
 @validate_finalize
 def validate_password(password, confirm, _error_ids):
-    if VALIDATION_ERROR_SHORT not in _error_ids and password in COMMON_PASSWORDS:
+    if VALIDATION_ERROR_SHORT not in _error_ids and (password in COMMON_PASSWORDS or password in COMMON_PASSWORD_INDEX):
         _error_ids.append(VALIDATION_ERROR_COMMON)
     return format_error_message('Password', _error_ids,
                                 min_length=PASSWORD_MIN_LENGTH,
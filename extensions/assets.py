@@ -0,0 +1,156 @@
+#Give each static file a URL containing a hash of its contents
+#Templates use {{ asset_url('style.css') }} to get a URL like
+#/static/style.0123456789ab.css, which is served with a one year immutable
+#Cache-Control, as a change to the file means a different URL.
+#Run "python -m extensions.assets static flaskapp/static" as a build step to
+#save the manifest, otherwise it's made when the app starts.
+from __future__ import absolute_import
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+from flask import url_for
+
+from extensions.precompress import PRECOMPRESS_SUFFIXES
+
+
+ASSET_MANIFEST_NAME = 'asset-manifest.json'
+
+ASSET_HASH_LENGTH = 12
+
+ASSET_MAX_AGE = 31536000
+
+#Files that are other versions of an asset rather than assets themselves
+ASSET_IGNORE_SUFFIXES = tuple(suffix for _, suffix in PRECOMPRESS_SUFFIXES) + ('.map',)
+
+
+def hashed_name(filename, digest):
+    """Add a hash to a filename, before the extension.
+
+    >>> hashed_name('css/style.css', '0123456789ab')
+    'css/style.0123456789ab.css'
+    >>> hashed_name('LICENSE', '0123456789ab')
+    'LICENSE.0123456789ab'
+    """
+    directory, name = os.path.split(filename)
+    base, ext = os.path.splitext(name)
+    return os.path.join(directory, '{}.{}{}'.format(base, digest, ext)).replace(os.sep, '/')
+
+
+#Name made by hashed_name, so there's no need to add another hash
+HASHED_NAME = re.compile(r'\.[0-9a-f]{{{}}}(\.[^./]*)?$'.format(ASSET_HASH_LENGTH))
+
+
+def asset_name(filename, digest):
+    """Get the hashed name for a file, unless it already has one."""
+    if HASHED_NAME.search(filename):
+        return filename
+    return hashed_name(filename, digest)
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()[:ASSET_HASH_LENGTH]
+
+
+def build_manifest(directory):
+    """Map the path of every asset in a directory to its hashed name."""
+    manifest = {}
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            if name == ASSET_MANIFEST_NAME or name.endswith(ASSET_IGNORE_SUFFIXES):
+                continue
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, directory).replace(os.sep, '/')
+            manifest[filename] = asset_name(filename, file_digest(path))
+    return manifest
+
+
+def save_manifest(directory):
+    manifest = build_manifest(directory)
+    with open(os.path.join(directory, ASSET_MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class AssetManifest(object):
+    """Serve static files from hashed URLs, and add asset_url to the templates.
+
+    The manifest is loaded from asset-manifest.json in the static folder if
+    it exists, or made when the app starts. With ASSETS_RELOAD (on by
+    default in debug mode), files are checked for changes each time
+    asset_url is used, so edits show up without a restart.
+
+    Set this up after PrecompressedStatic, as it wraps the static view.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.manifest = {}
+        self.files = {}
+        self.modified = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_RELOAD', app.debug)
+        self.directory = app.static_folder
+        self.reload = app.config['ASSETS_RELOAD']
+
+        path = os.path.join(self.directory, ASSET_MANIFEST_NAME)
+        if not self.reload and os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+        else:
+            manifest = build_manifest(self.directory)
+        for filename, hashed in manifest.items():
+            self._add(filename, hashed)
+
+        self.static_view = app.view_functions['static']
+        app.view_functions['static'] = self.send_static_file
+        app.add_template_global(self.asset_url)
+
+    def _add(self, filename, hashed):
+        #Old names still work (for pages cached before a change), but aren't cached as long
+        self.manifest[filename] = hashed
+        self.files[hashed] = filename
+
+    def _check(self, filename):
+        """Update the hashed name if a file has changed."""
+        path = os.path.join(self.directory, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        modified = (stat.st_mtime, stat.st_size)
+        if self.modified.get(filename) != modified:
+            self.modified[filename] = modified
+            self._add(filename, asset_name(filename, file_digest(path)))
+
+    def asset_url(self, filename, **kwargs):
+        """Get the URL of a static file, with a hash of its contents if it's known."""
+        if self.reload:
+            self._check(filename)
+        return url_for('static', filename=self.manifest.get(filename, filename), **kwargs)
+
+    def send_static_file(self, filename):
+        original = self.files.get(filename)
+        if original is None:
+            return self.static_view(filename)
+
+        response = self.static_view(original)
+        if response.status_code == 200 and self.manifest[original] == filename:
+            response.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(ASSET_MAX_AGE)
+            response.expires = time.time() + ASSET_MAX_AGE
+        return response
+
+
+if __name__ == '__main__':
+    for directory in sys.argv[1:]:
+        print('{}: {} assets'.format(directory, len(save_manifest(directory))))
@@ -0,0 +1,327 @@
+#Combine and minify the stylesheets and scripts that each layout loads
+#Bundles are set in ASSET_BUNDLES, and templates use {{ bundle_url('layout.css') }}.
+#Each bundle is written to the "bundles" folder of the static folder with a hash
+#of its contents in the filename, along with a source map and compressed copies.
+from __future__ import absolute_import
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+
+from flask import url_for
+
+from extensions.assets import ASSET_HASH_LENGTH, hashed_name
+from extensions.precompress import precompress_file, PRECOMPRESS_SUFFIXES
+
+
+#Characters that never need a space next to them
+CSS_TIGHT = set('{};,>')
+
+JS_TIGHT = set('{}()[];,=:?&|')
+
+#Characters that never need a space after them
+CSS_TIGHT_AFTER = set(':')
+
+#A "/" after these starts a regular expression instead of a division
+JS_REGEX_AFTER = set('(,=:[!&|?{};+-*%<>~^')
+
+JS_REGEX_KEYWORDS = set(['return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'void',
+                         'delete', 'new', 'throw', 'instanceof', 'yield', 'await'])
+
+JS_WORD = re.compile(r'[\w$]+$')
+
+BASE64_VLQ = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+#Old bundles to keep, so pages from before a restart still work
+BUNDLE_HISTORY = 3
+
+
+def minify_lines(text, kind):
+    """Minify CSS or JS without joining any lines together.
+    Comments (apart from /*! ones), indentation and unneeded spaces are
+    removed, and empty lines are dropped. Keeping the line breaks means
+    automatic semicolon insertion still works, and each line can be
+    mapped back to where it came from.
+    Returns a list of (line, source line, source column).
+
+    >>> minify_lines('a  {\\n  color : red; /* x */\\n}\\n', 'css')
+    [('a{', 0, 0), ('color :red;', 1, 2), ('}', 2, 0)]
+    >>> [i[0] for i in minify_lines('var a = b / 2; // half\\nvar r = /[/]x/g;', 'js')]
+    ['var a=b / 2;', 'var r=/[/]x/g;']
+    """
+    js = kind == 'js'
+    tight = JS_TIGHT if js else CSS_TIGHT
+    tight_after = tight if js else tight | CSS_TIGHT_AFTER
+    lines = []
+    line = []
+    start = None
+    previous = ''
+    space = False
+    mode = 'code'
+    quote = None
+    braces = []
+    row = col = 0
+    i = 0
+    length = len(text)
+
+    while i < length:
+        char = text[i]
+        following = text[i + 1] if i + 1 < length else ''
+
+        if char == '\n':
+            #Text that continues onto the next line is kept exactly as it is
+            if mode == 'string' and not (line and line[-1] == '\\'):
+                mode = 'code'
+            elif mode == 'line comment':
+                mode = 'code'
+            verbatim = mode in ('string', 'template', 'preserved')
+            if line or verbatim:
+                previous = ''.join(line)
+                if not verbatim:
+                    previous = previous.rstrip()
+                lines.append((previous, start[0], start[1]))
+            line = []
+            start = (row + 1, 0) if verbatim else None
+            space = False
+            row += 1
+            col = 0
+            i += 1
+            continue
+
+        added = []
+        if mode == 'code':
+            if char in ' \t\r\f\v':
+                space = bool(line)
+            elif char == '/' and following == '*':
+                if text.startswith('/*!', i):
+                    mode = 'preserved'
+                    if space:
+                        added.append(' ')
+                    added.append('/*')
+                else:
+                    mode = 'block comment'
+                    space = bool(line)
+                i += 1
+                col += 1
+            elif js and char == '/' and following == '/':
+                mode = 'line comment'
+            else:
+                if space and line and line[-1][-1] not in tight_after and char not in tight:
+                    added.append(' ')
+                space = False
+                if char in '\'"':
+                    mode = 'string'
+                    quote = char
+                elif js and char == '`':
+                    mode = 'template'
+                elif js and char == '/':
+                    before = ''.join(line[-16:]).rstrip() if line else previous[-16:]
+                    word = JS_WORD.search(before)
+                    if not before or before[-1] in JS_REGEX_AFTER or word and word.group() in JS_REGEX_KEYWORDS:
+                        mode = 'regex'
+                elif js and char == '{':
+                    if braces:
+                        braces[-1] += 1
+                elif js and char == '}' and braces:
+                    if braces[-1]:
+                        braces[-1] -= 1
+                    else:
+                        braces.pop()
+                        mode = 'template'
+                added.append(char)
+
+        elif mode in ('block comment', 'preserved'):
+            if char == '*' and following == '/':
+                if mode == 'preserved':
+                    added.append('*/')
+                mode = 'code'
+                i += 1
+                col += 1
+            elif mode == 'preserved':
+                added.append(char)
+
+        elif mode != 'line comment':
+            added.append(char)
+            if char == '\\':
+                if following and following != '\n':
+                    added.append(following)
+                    i += 1
+                    col += 1
+            elif mode == 'string' and char == quote:
+                mode = 'code'
+            elif mode == 'template' and char == '`':
+                mode = 'code'
+            elif mode == 'template' and char == '$' and following == '{':
+                added.append('{')
+                braces.append(0)
+                mode = 'code'
+                i += 1
+                col += 1
+            elif mode == 'regex' and char == '[':
+                mode = 'regex class'
+            elif mode == 'regex class' and char == ']':
+                mode = 'regex'
+            elif mode == 'regex' and char == '/':
+                mode = 'code'
+
+        if added:
+            if start is None:
+                start = (row, col)
+            line.extend(added)
+        i += 1
+        col += 1
+
+    if line:
+        lines.append((''.join(line) if mode in ('string', 'template', 'preserved') else ''.join(line).rstrip(), start[0], start[1]))
+    return lines
+
+
+def _vlq(value):
+    value = (-value << 1) | 1 if value < 0 else value << 1
+    encoded = ''
+    while True:
+        digit = value & 31
+        value >>= 5
+        if value:
+            digit |= 32
+        encoded += BASE64_VLQ[digit]
+        if not value:
+            return encoded
+
+
+def source_map(filename, sources, mapped_lines):
+    """Create a version 3 source map where each line maps to the start of a source line.
+    mapped_lines is a list of (source index, line, column), or None for added lines.
+    """
+    mappings = []
+    previous = [0, 0, 0]
+    for mapping in mapped_lines:
+        if mapping is None:
+            mappings.append('')
+            continue
+        mappings.append('A' + ''.join(_vlq(value - last) for value, last in zip(mapping, previous)))
+        previous = list(mapping)
+    return json.dumps({
+        'version': 3,
+        'file': filename,
+        'sources': sources,
+        'names': [],
+        'mappings': ';'.join(mappings),
+    })
+
+
+def _write(path, data):
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        f.write(data.encode('utf-8'))
+    try:
+        os.rename(temp_path, path)
+    except OSError:
+        os.remove(path)
+        os.rename(temp_path, path)
+
+
+def build_bundle(directory, name, files, folder='bundles'):
+    """Combine files from the static folder into one minified file.
+    Returns the path of the bundle relative to the static folder.
+    """
+    base, ext = os.path.splitext(name)
+    kind = ext.lstrip('.')
+    output = []
+    mapped = []
+    for index, filename in enumerate(files):
+        with open(os.path.join(directory, filename), 'rb') as f:
+            text = f.read().decode('utf-8')
+        #Stop the next script from continuing the last statement
+        if kind == 'js' and output:
+            output.append(';')
+            mapped.append(None)
+        for line, row, col in minify_lines(text, kind):
+            output.append(line)
+            mapped.append((index, row, col))
+    content = '\n'.join(output) + '\n'
+
+    bundle_dir = os.path.join(directory, folder)
+    if not os.path.isdir(bundle_dir):
+        os.makedirs(bundle_dir)
+    digest = hashlib.sha1(content.encode('utf-8')).hexdigest()[:ASSET_HASH_LENGTH]
+    filename = hashed_name(name, digest)
+
+    path = os.path.join(bundle_dir, filename)
+    if not os.path.exists(path):
+        sources = ['../' * (folder.count('/') + 1) + i for i in files]
+        _write(path + '.map', source_map(filename, sources, mapped))
+        if kind == 'css':
+            content += '/*# sourceMappingURL={}.map */\n'.format(filename)
+        else:
+            content += '//# sourceMappingURL={}.map\n'.format(filename)
+        _write(path, content)
+        precompress_file(path)
+
+    #Remove the oldest bundles
+    old = [i for i in glob.glob(os.path.join(bundle_dir, '{}.*{}'.format(base, ext))) if i != path]
+    for old_path in sorted(old, key=os.path.getmtime)[:-BUNDLE_HISTORY or None]:
+        for suffix in [''] + ['.map'] + [i for _, i in PRECOMPRESS_SUFFIXES]:
+            if os.path.exists(old_path + suffix):
+                os.remove(old_path + suffix)
+    return '{}/{}'.format(folder, filename)
+
+
+class Bundler(object):
+    """Build the bundles in ASSET_BUNDLES when the app starts, and add bundle_url to the templates.
+    With ASSETS_RELOAD, a bundle is built again when any of its files change.
+    Set this up before AssetManifest, so it knows about the bundles.
+
+    Example config:
+        app.config['ASSET_BUNDLES'] = {
+            'layout.css': ['style.css', 'sidebar.css'],
+            'layout.js': ['elasticize.js'],
+        }
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.bundles = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSET_BUNDLES', {})
+        app.config.setdefault('ASSETS_RELOAD', app.debug)
+        self.directory = app.static_folder
+        self.reload = app.config['ASSETS_RELOAD']
+        self.files = app.config['ASSET_BUNDLES']
+        for name in self.files:
+            self.build(name)
+        app.add_template_global(self.bundle_url)
+        self.jinja_globals = app.jinja_env.globals
+
+    def _modified(self, name):
+        return [os.path.getmtime(os.path.join(self.directory, i)) for i in self.files[name]]
+
+    def build(self, name):
+        modified = self._modified(name)
+        self.bundles[name] = (build_bundle(self.directory, name, self.files[name]), modified)
+        return self.bundles[name][0]
+
+    def bundle_url(self, name, **kwargs):
+        filename, modified = self.bundles[name]
+        if self.reload and self._modified(name) != modified:
+            filename = self.build(name)
+
+        #Use the asset manifest if there is one, to get the long cache time
+        asset_url = self.jinja_globals.get('asset_url')
+        if asset_url is not None:
+            return asset_url(filename, **kwargs)
+        return url_for('static', filename=filename, **kwargs)
+
+
+if __name__ == '__main__':
+    import importlib
+    for path in sys.argv[1:]:
+        module_name, app_name = path.split(':') if ':' in path else (path, 'app')
+        app = getattr(importlib.import_module(module_name), app_name)
+        for name in app.config.get('ASSET_BUNDLES', {}):
+            print('{}: {}'.format(path, build_bundle(app.static_folder, name, app.config['ASSET_BUNDLES'][name])))
@@ -0,0 +1,154 @@
+#Let browsers check if a page has changed instead of downloading it again
+#Responses get an ETag from a hash of the body, and a Last-Modified of when
+#that body was first seen. Requests with a matching If-None-Match (or a recent
+#enough If-Modified-Since) get an empty 304 response.
+#
+#Register it after Compress, so the ETag is made from the uncompressed body
+#(after_request functions run in reverse order). Compress then adds the
+#encoding to strong ETags, so each encoding has its own, e.g. "abc123-br".
+#Responses that already have an ETag (such as files from send_file) are
+#checked against it with each encoding added, as send_file only checks it
+#without one.
+from __future__ import absolute_import
+from collections import OrderedDict
+import calendar
+import hashlib
+import threading
+import time
+
+from flask import request, current_app
+from werkzeug.http import http_date
+
+from extensions.flask_compress import CODECS, add_vary
+
+
+def body_etag(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def etag_candidates(etag):
+    """Get the ETags a client may have been sent for a body.
+
+    >>> candidates = etag_candidates('abc')
+    >>> candidates[0], 'abc-gzip' in candidates
+    ('abc', True)
+    """
+    return [etag] + ['{}-{}'.format(etag, encoding) for encoding in sorted(CODECS)]
+
+
+class ConditionalResponses(object):
+    """Add ETag and Last-Modified headers, and answer conditional requests.
+
+    CONDITIONAL_WEAK_ETAGS makes the ETags weak, which means they are the
+    same for every encoding. CONDITIONAL_CACHE_CONTROL sets the
+    Cache-Control header for each endpoint, replacing the default.
+
+    Example config:
+        app.config['CONDITIONAL_CACHE_CONTROL'] = {
+            'index': 'public, max-age=60',
+            'account': 'private, no-cache',
+        }
+
+    >>> import os, tempfile
+    >>> from flask import Flask
+    >>> from extensions.flask_compress import Compress
+    >>> app = Flask(__name__, static_folder=tempfile.mkdtemp(), static_url_path='/static')
+    >>> with open(os.path.join(app.static_folder, 'style.css'), 'w') as f:
+    ...     _ = f.write('a { color: red; }\\n' * 100)
+    >>> compress, conditional = Compress(app), ConditionalResponses(app)
+    >>> client = app.test_client()
+    >>> response = client.get('/static/style.css', headers={'Accept-Encoding': 'gzip'})
+    >>> response.close()
+    >>> etag = response.headers['ETag']
+    >>> etag.endswith('-gzip"')
+    True
+    >>> response = client.get('/static/style.css', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    >>> response.status_code, response.headers['ETag'] == etag
+    (304, True)
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.first_seen = OrderedDict()
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CONDITIONAL_WEAK_ETAGS', False)
+        app.config.setdefault('CONDITIONAL_CACHE_CONTROL', {})
+        app.config.setdefault('CONDITIONAL_LAST_MODIFIED_SIZE', 4096)
+        app.after_request(self.after_request)
+
+    def last_modified(self, app, etag):
+        """Get when a body was first sent, remembering the most recent ones."""
+        now = int(time.time())
+        with self.lock:
+            modified = self.first_seen.pop(etag, now)
+            self.first_seen[etag] = modified
+            while len(self.first_seen) > app.config['CONDITIONAL_LAST_MODIFIED_SIZE']:
+                self.first_seen.popitem(last=False)
+        return modified
+
+    def not_modified(self, app, response):
+        """Turn a response into an empty 304 response."""
+        #The body isn't sent, but Vary must be the same as it would have been
+        if response.mimetype in app.config.get('COMPRESS_MIMETYPES', ()):
+            add_vary(response)
+        if hasattr(response.response, 'close'):
+            response.response.close()
+        response.direct_passthrough = False
+        response.status_code = 304
+        response.set_data(b'')
+        return response
+
+    def after_request(self, response):
+        app = self.app or current_app
+
+        policy = app.config['CONDITIONAL_CACHE_CONTROL'].get(request.endpoint)
+        if policy is not None:
+            response.headers['Cache-Control'] = policy
+            response.headers.pop('Pragma', None)
+            response.headers.pop('Expires', None)
+
+        if request.method not in ('GET', 'HEAD') or response.status_code != 200:
+            return response
+
+        #The client may have been sent the ETag with an encoding added
+        etag, weak = response.get_etag()
+        if etag is not None:
+            if request.if_none_match and not weak and 'Content-Encoding' not in response.headers:
+                matched = [tag for tag in etag_candidates(etag) if request.if_none_match.contains_weak(tag)]
+                if matched:
+                    response.set_etag(matched[0])
+                    return self.not_modified(app, response)
+            return response
+
+        if (response.is_streamed or
+                response.direct_passthrough or
+                'Content-Encoding' in response.headers or
+                'no-store' in response.headers.get('Cache-Control', '')):
+            return response
+
+        etag = body_etag(response.get_data())
+        weak = app.config['CONDITIONAL_WEAK_ETAGS']
+        response.set_etag(etag, weak)
+        modified = self.last_modified(app, etag)
+        response.headers['Last-Modified'] = http_date(modified)
+
+        #If-Modified-Since is only used when there's no If-None-Match
+        if request.if_none_match:
+            candidates = [etag] if weak else etag_candidates(etag)
+            matched = [tag for tag in candidates if request.if_none_match.contains_weak(tag)]
+            if not matched and not request.if_none_match.star_tag:
+                return response
+            if matched:
+                response.set_etag(matched[0], weak)
+        elif request.if_modified_since is None or modified > calendar.timegm(request.if_modified_since.utctimetuple()):
+            return response
+        return self.not_modified(app, response)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
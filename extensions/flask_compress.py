@@ -1,21 +1,161 @@
 #https://github.com/libwilliam/flask-compress/blob/master/flask_compress.py
-import sys
-from gzip import GzipFile
-from io import BytesIO
+import hashlib
+import threading
+import time
+import zlib
+from collections import OrderedDict
 
 from flask import request, current_app
+from werkzeug.wsgi import ClosingIterator
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
-if sys.version_info[:2] == (2, 6):
-    class GzipFile(GzipFile):
-        """ Backport of context manager support for python 2.6"""
-        def __enter__(self):
-            if self.fileobj is None:
-                raise ValueError("I/O operation on closed GzipFile object")
-            return self
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
-        def __exit__(self, *args):
-            self.close()
+
+def _compress_gzip(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _compress_deflate(data, level):
+    return zlib.compress(data, level)
+
+
+def _compress_brotli(data, level):
+    return brotli.compress(data, quality=level)
+
+
+def _compress_zstd(data, level):
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+class _ZlibStream(object):
+    """Incrementally compress with zlib (the wbits decide the format)."""
+
+    def __init__(self, level, wbits):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliStream(object):
+
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=level)
+        self.compress = getattr(self.compressor, 'process', None) or self.compressor.compress
+        self.flush = self.compressor.flush
+        self.finish = self.compressor.finish
+
+
+class _ZstdStream(object):
+
+    def __init__(self, level):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        self.compress = self.compressor.compress
+
+    def flush(self):
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+#Encodings that can be used, depending on which modules are installed
+CODECS = {'gzip': _compress_gzip, 'deflate': _compress_deflate}
+STREAM_CODECS = {
+    'gzip': lambda level: _ZlibStream(level, 16 + zlib.MAX_WBITS),
+    'deflate': lambda level: _ZlibStream(level, zlib.MAX_WBITS),
+}
+if brotli is not None:
+    CODECS['br'] = _compress_brotli
+    STREAM_CODECS['br'] = _BrotliStream
+if zstandard is not None:
+    CODECS['zstd'] = _compress_zstd
+    STREAM_CODECS['zstd'] = _ZstdStream
+
+#Use CPU time of the current thread if possible, so time spent waiting isn't counted
+_timer = getattr(time, 'thread_time', None) or time.time
+
+
+def parse_accept_encoding(header):
+    """Get the quality value of each encoding in an Accept-Encoding header.
+
+    >>> sorted(parse_accept_encoding('gzip;q=0.5, br, identity;q=0').items())
+    [('br', 1.0), ('gzip', 0.5), ('identity', 0.0)]
+    """
+    qualities = {}
+    for item in header.split(','):
+        params = item.split(';')
+        encoding = params[0].strip().lower()
+        if not encoding:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[encoding] = quality
+    return qualities
+
+
+def choose_encoding(header, algorithms):
+    """Choose the encoding the client prefers the most.
+    Encodings are checked in order, so ties go to the earliest one.
+
+    >>> choose_encoding('gzip, deflate', ['br', 'gzip', 'deflate'])
+    'gzip'
+    >>> choose_encoding('gzip;q=0.5, deflate', ['gzip', 'deflate'])
+    'deflate'
+    >>> choose_encoding('*;q=0.1, gzip;q=0', ['gzip', 'deflate'])
+    'deflate'
+    """
+    qualities = parse_accept_encoding(header)
+    wildcard = qualities.get('*', 0.0)
+    best = None
+    best_quality = 0.0
+    for encoding in algorithms:
+        quality = qualities.get(encoding, wildcard)
+        if encoding == 'gzip':
+            quality = qualities.get('gzip', qualities.get('x-gzip', wildcard))
+        if quality > best_quality:
+            best = encoding
+            best_quality = quality
+    return best
+
+
+def add_etag_encoding(response, encoding):
+    """Give a strong ETag a suffix for the encoding, as the bytes are now different.
+    Weak ETags are left alone, as the content still means the same.
+    """
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag('{}-{}'.format(etag, encoding))
+
+
+def add_vary(response, header='Accept-Encoding'):
+    vary = response.headers.get('Vary')
+    if vary:
+        if header.lower() not in vary.lower():
+            response.headers['Vary'] = '{}, {}'.format(vary, header)
+    else:
+        response.headers['Vary'] = header
 
 
 class DictCache(object):
@@ -30,6 +170,151 @@ class DictCache(object):
         self.data[key] = value
 
 
+class LRUCache(object):
+    """Cache compressed responses, limited by the total size of the values.
+    The least recently used values are removed when the limit is reached,
+    and values expire after a set number of seconds.
+    """
+
+    def __init__(self, max_size=32 * 1024 * 1024, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = 0
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value, expires = self.data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if self.ttl is not None and expires < time.time():
+                self.size -= len(value)
+                self.misses += 1
+                return None
+            self.data[key] = (value, expires)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_size:
+            return
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            try:
+                self.size -= len(self.data.pop(key)[0])
+            except KeyError:
+                pass
+            self.data[key] = (value, expires)
+            self.size += len(value)
+            while self.size > self.max_size:
+                self.size -= len(self.data.popitem(last=False)[1][0])
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.size = 0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    entries=len(self.data), size=self.size)
+
+
+class AdaptiveLevel(object):
+    """Choose the compression level based on how busy the worker is.
+
+    The time spent compressing is measured as a fraction of each window
+    and smoothed. Levels fall towards the fast ones as it nears the target,
+    and rise back to the normal levels once the load drops. Large responses
+    use lower levels, and the level can be shifted up or down by mimetype.
+    Responses that compress badly on a sample are not compressed at all.
+    """
+
+    #Fastest level for each encoding, used at full load
+    FAST_LEVELS = {'gzip': 1, 'deflate': 1, 'br': 1, 'zstd': 1}
+
+    #Static files get reused so are worth more effort than API responses
+    MIMETYPE_BIAS = {'text/css': 1, 'application/javascript': 1, 'application/json': -1}
+
+    def __init__(self, levels, fast_levels=None, mimetype_bias=None, target=0.25,
+                 window=1.0, smoothing=0.5, large_size=256 * 1024,
+                 sample_size=4096, sample_ratio=0.9):
+        self.levels = levels
+        self.fast_levels = fast_levels or self.FAST_LEVELS
+        self.mimetype_bias = self.MIMETYPE_BIAS if mimetype_bias is None else mimetype_bias
+        self.target = target
+        self.window = window
+        self.smoothing = smoothing
+        self.large_size = large_size
+        self.sample_size = sample_size
+        self.sample_ratio = sample_ratio
+        self.load = 0.0
+        self.busy = 0.0
+        self.window_start = time.time()
+        self.lock = threading.Lock()
+        self.skipped = 0
+
+    def _update(self):
+        """Fold the last window into the load if it has finished.
+        Must be called with the lock held.
+        """
+        now = time.time()
+        elapsed = now - self.window_start
+        if elapsed >= self.window:
+            self.load = self.load * self.smoothing + self.busy / elapsed * (1 - self.smoothing)
+            self.busy = 0.0
+            self.window_start = now
+
+    def record(self, seconds):
+        """Add time spent compressing."""
+        with self.lock:
+            self.busy += seconds
+            self._update()
+
+    def choose(self, encoding, size=None, mimetype=None):
+        with self.lock:
+            self._update()
+            load = self.load
+        high = self.levels[encoding]
+        low = min(high, self.fast_levels.get(encoding, 1))
+        pressure = min(1.0, load / self.target)
+        level = high - (high - low) * pressure
+        if size is not None and size > self.large_size:
+            level -= 2
+        level += self.mimetype_bias.get(mimetype, 0)
+        return int(round(max(low, min(high, level))))
+
+    def incompressible(self, data):
+        """Check if a sample from the middle of the data barely compresses."""
+        if len(data) < self.sample_size * 2:
+            return False
+        start = (len(data) - self.sample_size) // 2
+        sample = data[start:start + self.sample_size]
+        started = _timer()
+        result = len(zlib.compress(sample, 1)) > len(sample) * self.sample_ratio
+        self.record(_timer() - started)
+        if result:
+            self.skipped += 1
+        return result
+
+    def stats(self):
+        return dict(load=self.load, skipped=self.skipped)
+
+
+def default_cache_key(response):
+    """Identify a response by the endpoint, URL and a digest of the content.
+    A strong ETag is used as the digest if there is one.
+    """
+    digest, weak = response.get_etag()
+    if digest is None or weak:
+        digest = hashlib.sha1(response.get_data()).hexdigest()
+    return '{}:{}:{}'.format(request.endpoint, request.url, digest)
+
+
 class Compress(object):
     """
     The Compress object allows your application to use Flask-Compress.
@@ -55,19 +340,42 @@ class Compress(object):
             ('COMPRESS_MIMETYPES', ['text/html', 'text/css', 'text/xml',
                                     'application/json',
                                     'application/javascript']),
+            ('COMPRESS_ALGORITHM', ['br', 'zstd', 'gzip', 'deflate']),
             ('COMPRESS_LEVEL', 6),
+            ('COMPRESS_BR_LEVEL', 5),
+            ('COMPRESS_ZSTD_LEVEL', 3),
             ('COMPRESS_MIN_SIZE', 500),
             ('COMPRESS_CACHE_KEY', None),
             ('COMPRESS_CACHE_BACKEND', None),
+            ('COMPRESS_CACHE_OPTIONS', {}),
             ('COMPRESS_REGISTER', True),
+            ('COMPRESS_STREAMS', True),
+            ('COMPRESS_STREAM_FLUSH', 'chunk'),
+            ('COMPRESS_ADAPTIVE', False),
+            ('COMPRESS_ADAPTIVE_OPTIONS', {}),
         ]
 
         for k, v in defaults:
             app.config.setdefault(k, v)
 
+        #Ignore any encodings that aren't installed
+        self.algorithms = [i for i in app.config['COMPRESS_ALGORITHM'] if i in CODECS]
+        self.levels = {
+            'gzip': app.config['COMPRESS_LEVEL'],
+            'deflate': app.config['COMPRESS_LEVEL'],
+            'br': app.config['COMPRESS_BR_LEVEL'],
+            'zstd': app.config['COMPRESS_ZSTD_LEVEL'],
+        }
+
         backend = app.config['COMPRESS_CACHE_BACKEND']
-        self.cache = backend() if backend else None
-        self.cache_key = app.config['COMPRESS_CACHE_KEY']
+        self.cache = backend(**app.config['COMPRESS_CACHE_OPTIONS']) if backend else None
+        self.cache_key = app.config['COMPRESS_CACHE_KEY'] or default_cache_key
+
+        #The configured levels become the highest ones used
+        if app.config['COMPRESS_ADAPTIVE']:
+            self.adaptive = AdaptiveLevel(self.levels, **app.config['COMPRESS_ADAPTIVE_OPTIONS'])
+        else:
+            self.adaptive = None
 
         if (app.config['COMPRESS_REGISTER'] and
                 app.config['COMPRESS_MIMETYPES']):
@@ -75,43 +383,108 @@ class Compress(object):
 
     def after_request(self, response):
         app = self.app or current_app
-        accept_encoding = request.headers.get('Accept-Encoding', '')
 
         if (response.mimetype not in app.config['COMPRESS_MIMETYPES'] or
-            'gzip' not in accept_encoding.lower() or
             #not 200 <= response.status_code < 300 or
             (response.content_length is not None and
              response.content_length < app.config['COMPRESS_MIN_SIZE']) or
-            'Content-Encoding' in response.headers):
+            'Content-Encoding' in response.headers or
+            #Byte ranges would no longer match up with the content
+            response.status_code == 206 or
+            'Content-Range' in response.headers or
+            'Range' in request.headers):
+            return response
+
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', ''), self.algorithms)
+        if encoding is None:
+            add_vary(response)
+            return response
+
+        #Compress the chunks as they are sent instead of loading the whole response
+        if app.config['COMPRESS_STREAMS'] and (response.is_streamed or response.direct_passthrough):
+            response.response = self.compress_stream(app, response, encoding)
+            response.direct_passthrough = False
+            response.headers.pop('Content-Length', None)
+            response.headers['Content-Encoding'] = encoding
+            add_etag_encoding(response, encoding)
+            add_vary(response)
             return response
 
         response.direct_passthrough = False
 
-        if self.cache:
-            key = self.cache_key(response)
-            gzip_content = self.cache.get(key) or self.compress(app, response)
-            self.cache.set(key, gzip_content)
-        else:
-            gzip_content = self.compress(app, response)
+        content = None
+        if self.cache is not None:
+            key = '{}:{}'.format(self.cache_key(response), encoding)
+            content = self.cache.get(key)
+        if content is None:
+            content = self.compress(app, response, encoding)
+            if content is None:
+                add_vary(response)
+                return response
+            if self.cache is not None:
+                self.cache.set(key, content)
 
-        response.set_data(gzip_content)
+        response.set_data(content)
 
-        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Content-Encoding'] = encoding
         response.headers['Content-Length'] = response.content_length
+        add_etag_encoding(response, encoding)
+        add_vary(response)
 
-        vary = response.headers.get('Vary')
-        if vary:
-            if 'accept-encoding' not in vary.lower():
-                response.headers['Vary'] = '{}, Accept-Encoding'.format(vary)
+        return response
+
+    def compress(self, app, response, encoding='gzip'):
+        """Compress the response data.
+        Returns None if the adaptive level decides it isn't worth it.
+        """
+        data = response.get_data()
+        if self.adaptive is None:
+            return CODECS[encoding](data, self.levels[encoding])
+
+        if self.adaptive.incompressible(data):
+            return None
+        level = self.adaptive.choose(encoding, len(data), response.mimetype)
+        started = _timer()
+        content = CODECS[encoding](data, level)
+        self.adaptive.record(_timer() - started)
+        return content
+
+    def compress_stream(self, app, response, encoding='gzip'):
+        """Compress the response iterator one chunk at a time.
+        COMPRESS_STREAM_FLUSH decides when the compressed data gets sent:
+            'chunk': after every chunk (lowest delay)
+            'end': only when the compressor has enough data (smallest size)
+            int: once that many bytes have been added since the last flush
+        The original iterator is closed along with the new one, even if it is
+        closed before anything was read (such as for a HEAD request).
+        """
+        iterable = response.response
+        adaptive = self.adaptive
+        if adaptive is None:
+            level = self.levels[encoding]
         else:
-            response.headers['Vary'] = 'Accept-Encoding'
+            level = adaptive.choose(encoding, response.content_length, response.mimetype)
+        compressor = STREAM_CODECS[encoding](level)
+        flush = app.config['COMPRESS_STREAM_FLUSH']
+        flush_size = 0 if flush == 'chunk' else None if flush == 'end' else int(flush)
+        charset = response.mimetype_params.get('charset', 'utf-8')
 
-        return response
+        def generate():
+            pending = 0
+            for chunk in iterable:
+                if not isinstance(chunk, bytes):
+                    chunk = chunk.encode(charset)
+                started = _timer()
+                data = compressor.compress(chunk)
+                pending += len(chunk)
+                if flush_size is not None and pending and pending >= flush_size:
+                    data += compressor.flush()
+                    pending = 0
+                if adaptive is not None:
+                    adaptive.record(_timer() - started)
+                if data:
+                    yield data
+            yield compressor.finish()
 
-    def compress(self, app, response):
-        gzip_buffer = BytesIO()
-        with GzipFile(mode='wb',
-                      compresslevel=app.config['COMPRESS_LEVEL'],
-                      fileobj=gzip_buffer) as gzip_file:
-            gzip_file.write(response.get_data())
-        return gzip_buffer.getvalue()
+        #A generator that never started skips its finally block when closed
+        return ClosingIterator(generate(), getattr(iterable, 'close', None) or ())
@@ -2,7 +2,10 @@
 from __future__ import absolute_import
 #from html import escape
 import HTMLParser
+import hashlib
 import re
+import threading
+from collections import OrderedDict
 
 
 #Regular expressions to recognize different parts of HTML. 
@@ -33,9 +36,33 @@ N2RET = re.compile("\n\n+")
 #For converting HTML entities to unicode
 HTML_PARSER = HTMLParser.HTMLParser()
 
+#Every tag in one pattern, so they can all be removed in a single pass
+#Each part matches the same text as the pattern it replaces, except tags can't
+#contain "<" (see _convert). Inline flags can't be limited to part of a pattern,
+#so the letters are matched case by case. Only <p>, <div> and <br> are captured.
+TOKEN = re.compile(r"""
+    <[sS][cC][rR][iI][pP][tT].*?>.*?</[sS][cC][rR][iI][pP][tT]>
+    |<[sS][tT][yY][lL][eE].*?>.*?</[sS][tT][yY][lL][eE]>
+    |<!--.*?-->
+    |(</?(?:[pP]|[dD][iI][vV]|[bB][rR])[^<>]*>)
+    |<[^<>]*>
+""", re.DOTALL | re.VERBOSE)
 
-def html2text(html=None):
-    """Remove all HTML tags and produce a nicely formatted text."""
+#Comment that contains the start of a script or style tag
+COMMENT_SCRIPT = re.compile(r"<!--(?:(?!-->).)*?<(script|style)", re.IGNORECASE | re.DOTALL)
+
+HTML2TEXT_CACHE_SIZE = 256
+
+_CACHE = OrderedDict()
+
+_CACHE_LOCK = threading.Lock()
+
+
+def html2text_legacy(html=None):
+    """Remove all HTML tags and produce a nicely formatted text.
+    This makes a pass over the text for each step, so html2text is used
+    instead, with this as the fallback for input that it can't handle.
+    """
     if html is None:
         return u''
     text = unicode(html)
@@ -56,5 +83,74 @@ def html2text(html=None):
     return text.strip()
     
     
+class _Fallback(Exception):
+    pass
+
+
+def _convert(text):
+    """Convert the text with a single pass over the tags.
+    Raises _Fallback if the passes of html2text_legacy would interact in a
+    way that can't be reproduced, such as a tag inside another tag (or any
+    other "<" left over), or a script inside a comment.
+    """
+    #Newlines are the only whitespace that NWHITES changes and NSPACE doesn't,
+    #and replacing them first doesn't change what any of the tags match
+    text = text.replace('\n', ' ')
+    if '<!--' in text and COMMENT_SCRIPT.search(text):
+        raise _Fallback
+
+    parts = TOKEN.split(text)
+    parts[1::2] = ['' if block is None else '\n' for block in parts[1::2]]
+    text = ''.join(parts)
+    if '<' in text:
+        raise _Fallback
+    text = HTML_PARSER.unescape(text)
+
+    text = NSPACE.sub(" ", text)
+    if '\n ' in text:
+        text = RETSPACE.sub("\n", text)
+    if '\n\n' in text:
+        text = N2RET.sub("\n\n", text)
+    return text.strip()
+
+
+def html2text(html=None):
+    """Remove all HTML tags and produce a nicely formatted text.
+    Results are cached by a hash of the input, as the same email body
+    tends to be converted many times.
+
+    >>> html2text('<p>Hello&nbsp;<b>world</b></p><script>x</script>&lt;3')
+    u'Hello world\\n<3'
+    """
+    if html is None:
+        return u''
+    text = unicode(html)
+
+    key = hashlib.sha1(text.encode('utf-8')).digest()
+    with _CACHE_LOCK:
+        try:
+            result = _CACHE.pop(key)
+        except KeyError:
+            pass
+        else:
+            _CACHE[key] = result
+            return result
+
+    try:
+        result = _convert(text)
+    except _Fallback:
+        result = html2text_legacy(text)
+
+    with _CACHE_LOCK:
+        _CACHE[key] = result
+        while len(_CACHE) > HTML2TEXT_CACHE_SIZE:
+            _CACHE.popitem(last=False)
+    return result
+
+
 #def escape_html(html):
-#    return escape(html).encode('ascii', 'xmlcharrefreplace')
\ No newline at end of file
+#    return escape(html).encode('ascii', 'xmlcharrefreplace')
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
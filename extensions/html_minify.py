@@ -0,0 +1,103 @@
+#Remove the indentation and comments that templates add to each page
+#Pages from set_template are minified when HTML_MINIFY is set (or with
+#set_template(..., minify=True)), before they are cached or compressed.
+#It's off by default, as gzip already removes most of the repeated whitespace,
+#so minifying every request costs more time than it saves (see
+#benchmarks/html_minify.py). It's best used for pages with a cache_ttl, which
+#are only minified once.
+#Whitespace is only collapsed, never removed between inline elements, so the
+#page looks the same. Anything in <pre>, <textarea>, <script> and <style> is
+#left exactly as it is.
+from __future__ import absolute_import
+import re
+
+from flask import current_app
+
+
+#Elements that are kept exactly as they are, along with the tag itself
+HTML_PRESERVE = ('pre', 'textarea', 'script', 'style')
+
+#Whitespace next to these tags doesn't change how the page looks
+HTML_BLOCK_TAGS = set([
+    'doctype', 'html', 'head', 'body', 'title', 'meta', 'link', 'base',
+    'div', 'p', 'pre', 'blockquote', 'ul', 'ol', 'li', 'dl', 'dt', 'dd',
+    'table', 'caption', 'colgroup', 'col', 'thead', 'tbody', 'tfoot', 'tr', 'td', 'th',
+    'form', 'fieldset', 'legend', 'option', 'optgroup', 'br', 'hr',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'footer', 'nav', 'section',
+    'article', 'aside', 'main', 'figure', 'figcaption', 'address', 'noscript',
+])
+
+#Comments that browsers act on, such as <!--[if lt IE 9]>
+HTML_KEEP_COMMENTS = ('<!--[if', '<!--<![endif]', '<!--!')
+
+#Tags (with their name), and comments and elements to preserve kept whole
+HTML_TOKEN = re.compile(r'(<(?:!--.*?-->|({})\b.*?</\2\s*>|[/!]?([\w-]*)[^>]*>))'.format(
+    '|'.join(HTML_PRESERVE)), re.I | re.S)
+
+NEWLINE_SPACE = re.compile(r'[^\S\n]*\n\s*')
+
+EXTRA_SPACE = re.compile(r'[^\S\n]{2,}|[^\S \n]')
+
+
+def minify_html(html):
+    """Collapse whitespace and remove comments from HTML.
+    Whitespace is made a single newline if it had one, or a single space
+    otherwise, and removed next to block tags like <div> and <li>.
+
+    >>> minify_html(u'<ul>\\n  <li> <b>A</b>  <i>B</i> </li>\\n</ul><!-- x -->')
+    u'<ul><li><b>A</b> <i>B</i></li></ul>'
+    >>> minify_html(u'<div>\\n  <pre>  x\\n  y</pre>\\n</div>')
+    u'<div><pre>  x\\n  y</pre></div>'
+    """
+    #Split into text, tag, name of a preserved element, and name of any other tag
+    parts = HTML_TOKEN.split(html)
+    texts = parts[0::4]
+    tags = parts[1::4]
+    blocks = [True]
+    for i, name in enumerate(parts[3::4]):
+        if name is None:
+            name = parts[i * 4 + 2]
+            if name is None:
+                #Comments browsers act on count as block tags
+                if not tags[i].startswith(HTML_KEEP_COMMENTS):
+                    tags[i] = u''
+                blocks.append(True)
+                continue
+        blocks.append(name.lower() in HTML_BLOCK_TAGS)
+    blocks.append(True)
+
+    for i, text in enumerate(texts):
+        if not text:
+            continue
+        if text.isspace():
+            if blocks[i] or blocks[i + 1]:
+                texts[i] = u''
+            else:
+                texts[i] = u'\n' if u'\n' in text else u' '
+            continue
+        if u'\n' in text or u'  ' in text or u'\t' in text:
+            text = EXTRA_SPACE.sub(u' ', NEWLINE_SPACE.sub(u'\n', text))
+        if blocks[i]:
+            text = text.lstrip()
+        if blocks[i + 1]:
+            text = text.rstrip()
+        texts[i] = text
+
+    output = [None] * (len(texts) + len(tags))
+    output[0::2] = texts
+    output[1::2] = tags
+    return u''.join(output)
+
+
+def minify_page(html, minify=None):
+    """Minify the output of a template, if HTML_MINIFY is set or minify is True."""
+    if minify is None:
+        minify = current_app.config.get('HTML_MINIFY', False)
+    if minify:
+        return minify_html(html)
+    return html
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
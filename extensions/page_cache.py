@@ -0,0 +1,259 @@
+#Cache the rendered HTML of pages that are the same for many visitors
+#Enable for a page with set_template(..., cache_ttl=seconds). The page function
+#still runs (so sessions and redirects work as normal), but the template is only
+#rendered when the cache doesn't already have the output.
+from __future__ import absolute_import
+from collections import OrderedDict
+import datetime
+import decimal
+import hashlib
+import threading
+import time
+import uuid
+
+from flask import request
+from markupsafe import escape
+
+
+#Session values that are different for every visitor, and are filled in after loading from the cache
+PAGE_CACHE_HOLES = ('csrf_token', 'csrf_form')
+
+#Types with a repr that only depends on the value, so it can be part of a key
+PAGE_CACHE_KEY_TYPES = (type(None), bool, int, float, bytes, type(u''), decimal.Decimal,
+                        datetime.date, datetime.time, datetime.timedelta)
+try:
+    PAGE_CACHE_KEY_TYPES += (long,)
+except NameError:
+    pass
+
+
+def stable_repr(value):
+    """Get a repr of a value that's the same whenever the contents are.
+    Returns None if it contains anything else, such as an object with the
+    default repr (which has its memory address).
+
+    >>> stable_repr({'b': [1, (2.5, None)], 'a': set(['x', 'y'])}) == stable_repr({'a': set(['y', 'x']), 'b': [1, (2.5, None)]})
+    True
+    >>> stable_repr({'user': object()}) is None
+    True
+    """
+    if isinstance(value, dict):
+        items = []
+        for k, v in value.items():
+            k, v = stable_repr(k), stable_repr(v)
+            if k is None or v is None:
+                return None
+            items.append('{}: {}'.format(k, v))
+        return '{{{}}}'.format(', '.join(sorted(items)))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [stable_repr(i) for i in value]
+        if None in items:
+            return None
+        if isinstance(value, (set, frozenset)):
+            items.sort()
+        return '{}({})'.format(type(value).__name__, ', '.join(items))
+    if isinstance(value, PAGE_CACHE_KEY_TYPES):
+        return repr(value)
+    return None
+
+
+class PageCacheBackend(object):
+    """Storage used by PageCache.
+    Implement this to share the cache between processes (such as with
+    memcached or redis). Values are unicode strings.
+    """
+
+    def get(self, key):
+        """Get a value, or None if it's missing or expired."""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def incr(self, key):
+        """Increase a counter (starting from 0) and return the new value.
+        Counters must not expire or be evicted.
+        """
+        raise NotImplementedError
+
+    def counter(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryPageCache(PageCacheBackend):
+    """Keep pages in memory, limited by the total size of the values.
+    The least recently used values are removed when the limit is reached.
+    """
+
+    def __init__(self, max_size=16 * 1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self.data = OrderedDict()
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value, expires = self.data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires < time.time():
+                self.size -= len(value)
+                self.misses += 1
+                return None
+            self.data[key] = (value, expires)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl):
+        if len(value) > self.max_size:
+            return
+        with self.lock:
+            try:
+                self.size -= len(self.data.pop(key)[0])
+            except KeyError:
+                pass
+            self.data[key] = (value, time.time() + ttl)
+            self.size += len(value)
+            while self.size > self.max_size:
+                self.size -= len(self.data.popitem(last=False)[1][0])
+                self.evictions += 1
+
+    def incr(self, key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+    def counter(self, key):
+        return self.counters.get(key, 0)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.size = 0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    entries=len(self.data), size=self.size)
+
+
+class HoleSession(object):
+    """Session passed to a template while it's rendered for the cache.
+    Values in PAGE_CACHE_HOLES are replaced with placeholders, and the real
+    values are put back in by PageCache.fill for each visitor.
+    """
+
+    def __init__(self, session, placeholders):
+        self._session = session
+        self._placeholders = placeholders
+
+    def __getitem__(self, item):
+        if item in self._placeholders:
+            return self._placeholders[item]
+        return self._session[item]
+
+    def get(self, item, default=None):
+        if item in self._placeholders:
+            return self._placeholders[item]
+        return self._session.get(item, default)
+
+    def __getattr__(self, attr):
+        return getattr(self._session, attr)
+
+
+class PageCache(object):
+    """Store rendered pages by template, URL, user class and page data.
+
+    The page data is the dict returned by the page function, so the cache
+    only skips rendering when that would produce the same output. Pages
+    with data that can't be made into a key (see stable_repr) aren't
+    cached, as the key would be different every time. Pages
+    for logged in users are only cached with cache_users=True, and then
+    separately for each permission level.
+
+    Invalidate every page with a template (or every page) with invalidate().
+    This changes a generation counter instead of removing anything, so it
+    works the same with a shared backend.
+    """
+
+    def __init__(self, backend=None, holes=PAGE_CACHE_HOLES):
+        self.backend = backend if backend is not None else MemoryPageCache()
+        self.holes = holes
+        token = uuid.uuid4().hex
+        self.placeholders = dict((name, 'pagecachehole{}{}'.format(token, i)) for i, name in enumerate(holes))
+
+    def user_class(self, session):
+        """Get the part of the session that a cached page can depend on."""
+        if session is None:
+            return 'anonymous'
+        account = session.get('account_data', {}) or {}
+        if not account.get('id', 0):
+            return 'anonymous'
+        return 'permission:{}'.format(account.get('permission', 0))
+
+    def key(self, template, status_code, result, session=None, cache_users=False):
+        """Get the key for a page, or None if it can't be cached."""
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        user_class = self.user_class(session)
+        if user_class != 'anonymous' and not cache_users:
+            return None
+        if session is not None and any(session.get(name, None) is None for name in self.holes):
+            return None
+
+        data = stable_repr(result)
+        if data is None:
+            return None
+
+        generation = '{}.{}'.format(self.backend.counter('generation'),
+                                    self.backend.counter('generation:{}'.format(template)))
+        parts = [template, str(status_code), request.path, repr(sorted(request.args.items(multi=True))),
+                 user_class, data]
+        digest = hashlib.sha1('\0'.join(parts).encode('utf-8')).hexdigest()
+        return 'page:{}:{}:{}'.format(template, generation, digest)
+
+    def punch(self, session):
+        """Get the session to render a cached page with."""
+        if session is None:
+            return None
+        return HoleSession(session, self.placeholders)
+
+    def fill(self, body, session):
+        """Put the values for the current session into a cached page."""
+        if session is None:
+            return body
+        for name, placeholder in self.placeholders.items():
+            body = body.replace(placeholder, escape(session.get(name, '')))
+        return body
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, body, ttl):
+        self.backend.set(key, body, ttl)
+
+    def invalidate(self, template=None):
+        """Stop using the cached pages for a template, or for every template."""
+        if template is None:
+            self.backend.incr('generation')
+        else:
+            self.backend.incr('generation:{}'.format(template))
+
+
+#Shared by set_template, replace the backend with PAGE_CACHE.backend = ...
+PAGE_CACHE = PageCache()
+
+
+def invalidate_page_cache(template=None):
+    PAGE_CACHE.invalidate(template)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,133 @@
+#Serve static files from compressed copies made in advance
+#Run "python -m extensions.precompress static flaskapp/static" as a build step,
+#or let PrecompressedStatic do it when the app starts.
+from __future__ import absolute_import
+import mimetypes
+import os
+import sys
+
+from flask import request, send_from_directory, current_app
+
+from extensions.flask_compress import CODECS, choose_encoding, add_vary
+
+try:
+    from werkzeug.utils import safe_join
+except ImportError:
+    from werkzeug.security import safe_join
+
+
+PRECOMPRESS_EXTENSIONS = ('.css', '.js', '.html', '.json', '.svg', '.txt', '.xml')
+
+#File suffix of each encoding, in order of preference
+PRECOMPRESS_SUFFIXES = [('br', '.br'), ('gzip', '.gz')]
+
+#Files are only compressed once, so use the slowest levels
+PRECOMPRESS_LEVELS = {'br': 11, 'gzip': 9}
+
+
+def _write(path, data):
+    """Write a file through a temporary one, so it's never sent half written."""
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    try:
+        os.rename(temp_path, path)
+    except OSError:
+        os.remove(path)
+        os.rename(temp_path, path)
+
+
+def precompress_file(path, encodings=None):
+    """Write a compressed copy of a file for each encoding.
+    Copies newer than the file are left alone, and copies that end up
+    larger than the original are not kept.
+    Returns the number of files written.
+    """
+    if encodings is None:
+        encodings = [i for i, _ in PRECOMPRESS_SUFFIXES]
+    suffixes = dict(PRECOMPRESS_SUFFIXES)
+
+    modified = os.path.getmtime(path)
+    data = None
+    written = 0
+    for encoding in encodings:
+        if encoding not in CODECS:
+            continue
+        compressed_path = path + suffixes[encoding]
+        if os.path.exists(compressed_path) and os.path.getmtime(compressed_path) >= modified:
+            continue
+
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        compressed = CODECS[encoding](data, PRECOMPRESS_LEVELS[encoding])
+        if len(compressed) >= len(data):
+            if os.path.exists(compressed_path):
+                os.remove(compressed_path)
+            continue
+        _write(compressed_path, compressed)
+        written += 1
+    return written
+
+
+def precompress_directory(directory, extensions=PRECOMPRESS_EXTENSIONS, encodings=None):
+    """Write compressed copies of every matching file in a directory."""
+    written = 0
+    for root, dirs, files in os.walk(directory):
+        for filename in files:
+            if filename.lower().endswith(extensions):
+                written += precompress_file(os.path.join(root, filename), encodings)
+    return written
+
+
+def send_precompressed(directory, filename, **kwargs):
+    """Send a file, using the best compressed copy the client accepts.
+    Copies older than the file are ignored, as they have the old content.
+    """
+    path = safe_join(directory, filename)
+    available = []
+    if path is not None and os.path.isfile(path):
+        modified = os.path.getmtime(path)
+        for encoding, suffix in PRECOMPRESS_SUFFIXES:
+            if os.path.isfile(path + suffix) and os.path.getmtime(path + suffix) >= modified:
+                available.append(encoding)
+    if not available:
+        return send_from_directory(directory, filename, **kwargs)
+
+    encoding = choose_encoding(request.headers.get('Accept-Encoding', ''), available)
+    if encoding is None:
+        response = send_from_directory(directory, filename, **kwargs)
+    else:
+        kwargs.setdefault('mimetype', mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response = send_from_directory(directory, filename + dict(PRECOMPRESS_SUFFIXES)[encoding], **kwargs)
+        response.headers['Content-Encoding'] = encoding
+    add_vary(response)
+    return response
+
+
+class PrecompressedStatic(object):
+    """Replace the static file view so it sends precompressed copies.
+    Copies are made when the app starts, unless PRECOMPRESS_ON_STARTUP
+    is disabled (such as when they are made at build time instead).
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PRECOMPRESS_ON_STARTUP', True)
+        if app.config['PRECOMPRESS_ON_STARTUP'] and app.static_folder:
+            precompress_directory(app.static_folder)
+        app.view_functions['static'] = self.send_static_file
+
+    def send_static_file(self, filename):
+        app = self.app or current_app
+        return send_precompressed(app.static_folder, filename,
+                                  cache_timeout=app.get_send_file_max_age(filename))
+
+
+if __name__ == '__main__':
+    for directory in sys.argv[1:]:
+        print('{}: {} files written'.format(directory, precompress_directory(directory)))
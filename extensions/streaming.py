@@ -0,0 +1,106 @@
+#Send a template to the browser while it's still being rendered
+#Enable for a page with set_template(..., stream=True). The page up to </head>
+#is sent as soon as it's ready, so the browser can start loading the stylesheets
+#and scripts, and the rest follows in pieces of about TEMPLATE_STREAM_BUFFER
+#characters. Only the current piece is held in memory, so for big tables the
+#page function should return an iterator (such as a query) instead of a list.
+#
+#Compress compresses each piece as it's sent. Streamed pages aren't minified,
+#cached, or given an ETag, as the whole page is never available at once.
+#Flask's own session is saved before the first piece is sent, so templates
+#shouldn't change it (core.session is saved after the last piece instead).
+from __future__ import absolute_import
+
+from flask import current_app, _request_ctx_stack
+
+
+TEMPLATE_STREAM_BUFFER = 8192
+
+
+def buffer_stream(pieces, buffer_size=TEMPLATE_STREAM_BUFFER):
+    """Join the small pieces of a template into larger chunks.
+    The chunk ending with </head> is sent straight away.
+
+    >>> list(buffer_stream([u'<head>', u'</head>', u'<p>', u'a', u'</p>'], 10))
+    [u'<head></head>', u'<p>a</p>']
+    """
+    buffer = []
+    size = 0
+    head = True
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if head and u'</head>' in piece:
+            head = False
+        elif size < buffer_size:
+            continue
+        yield u''.join(buffer)
+        buffer = []
+        size = 0
+    if buffer:
+        yield u''.join(buffer)
+
+
+def stream_with_close(chunks, on_close=None):
+    """Keep the request context until a stream ends, like flask.stream_with_context.
+    on_close is called in the request context when the stream ends or is
+    closed, even if nothing was read (such as for a HEAD request or when the
+    client disconnects). Anything wrapping the stream must close it too.
+
+    >>> from flask import Flask, Response
+    >>> from extensions.flask_compress import Compress
+    >>> app = Flask(__name__)
+    >>> compress = Compress(app)
+    >>> streams, closed = [], []
+    >>> @app.route('/')
+    ... def page():
+    ...     #Keep the stream, so it isn't just closed by being garbage collected
+    ...     streams.append(stream_with_close(iter([u'a' * 1000]), lambda: closed.append(True)))
+    ...     return Response(streams[-1])
+    >>> client = app.test_client()
+    >>> for method in 'HEAD', 'GET':
+    ...     response = client.open('/', method=method, headers={'Accept-Encoding': 'gzip'})
+    ...     print(response.headers['Content-Encoding'])
+    ...     response.close()
+    gzip
+    gzip
+    >>> closed, _request_ctx_stack.top is None
+    ([True, True], True)
+    """
+    ctx = _request_ctx_stack.top
+    if ctx is None:
+        raise RuntimeError('stream_with_close needs an active request context')
+
+    def generate():
+        with ctx:
+            try:
+                #Stop here until the first chunk is read, so the context is already pushed
+                yield None
+                for chunk in chunks:
+                    yield chunk
+            finally:
+                if hasattr(chunks, 'close'):
+                    chunks.close()
+                if on_close is not None:
+                    on_close()
+
+    stream = generate()
+    next(stream)
+    return stream
+
+
+def stream_template(template_name, on_close=None, **context):
+    """Render a template in chunks, with the same context as render_template.
+    The request context is kept until the last chunk is sent, and then
+    on_close is called.
+    """
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    template = app.jinja_env.get_or_select_template(template_name)
+    buffer_size = app.config.get('TEMPLATE_STREAM_BUFFER', TEMPLATE_STREAM_BUFFER)
+    return stream_with_close(buffer_stream(template.generate(context), buffer_size), on_close)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,62 @@
+#Keep compiled templates on disk so new workers don't compile them from source
+#Each worker loads the bytecode written by the first one (or by running
+#"python -m extensions.template_cache flaskapp.app:app" when deploying), and
+#every template is loaded when the app starts instead of on its first request.
+#A template is compiled again whenever its source changes, as the bytecode is
+#stored with a hash of the source.
+from __future__ import absolute_import, print_function
+import importlib
+import sys
+import time
+
+from jinja2 import FileSystemBytecodeCache, TemplateSyntaxError
+
+
+def precompile(app):
+    """Load every template of an app, writing any missing bytecode to the cache.
+    Returns the number of templates loaded.
+    """
+    env = app.jinja_env
+    loaded = 0
+    for name in env.list_templates():
+        try:
+            env.get_template(name)
+        except TemplateSyntaxError as e:
+            print('Failed to compile {}: {}'.format(name, e), file=sys.stderr)
+        else:
+            loaded += 1
+    return loaded
+
+
+class TemplateCache(object):
+    """Store compiled templates in TEMPLATE_CACHE_DIR.
+    The default directory is the one Jinja uses, which is shared by every
+    process of the same user. TEMPLATE_CACHE_PRELOAD loads all the templates
+    when the app starts, so set it up after registering any blueprints.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TEMPLATE_CACHE_DIR', None)
+        app.config.setdefault('TEMPLATE_CACHE_PRELOAD', True)
+        self.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+        app.jinja_env.bytecode_cache = self.bytecode_cache
+        if app.config['TEMPLATE_CACHE_PRELOAD']:
+            precompile(app)
+
+    def clear(self):
+        self.bytecode_cache.clear()
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        module_name, app_name = path.split(':') if ':' in path else (path, 'app')
+        app = getattr(importlib.import_module(module_name), app_name)
+        if not isinstance(app.jinja_env.bytecode_cache, FileSystemBytecodeCache):
+            TemplateCache(app)
+        start = time.time()
+        print('{}: {} templates compiled in {:.2f}s'.format(path, precompile(app), time.time() - start))
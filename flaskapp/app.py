@@ -7,14 +7,27 @@ from flask import Flask
 sys.path.append(os.path.abspath(__file__).rsplit(os.path.sep, 2)[0])
 from flaskapp.database import *
 from flaskapp.views import blueprints
+from extensions.precompress import PrecompressedStatic
+from extensions.template_cache import TemplateCache
+from extensions.conditional import ConditionalResponses
+from extensions.assets import AssetManifest
+from extensions.bundles import Bundler
 
 app = Flask(__name__)
 app.debug = True
 app.secret_key = 123
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['ASSET_BUNDLES'] = {
+    'layout.css': ['style.css', 'sidebar.css', 'galleria.css', 'carousel.css'],
+}
+PrecompressedStatic(app)
+Bundler(app)
+AssetManifest(app)
+ConditionalResponses(app)
 for blueprint in blueprints:
     app.register_blueprint(blueprint)
+TemplateCache(app)
 
 # Initialise the database and set the context (https://flask-sqlalchemy.palletsprojects.com/en/2.x/contexts)
 db.init_app(app)
@@ -30,9 +30,9 @@ def set_headers(output):
     response.headers['X-XSS-Protection'] = 1
     response.headers['X-Content-Type-Options'] = 'nosniff'
     
-    #Disable caching
+    #Always check for changes (responses still have an ETag, so unchanged pages aren't sent again)
     if not PRODUCTION_SERVER:
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+        response.headers['Cache-Control'] = 'no-cache, must-revalidate'
         response.headers['Pragma'] = 'no-cache'
         response.headers['Expires'] = 0
         
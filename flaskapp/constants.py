@@ -1,6 +1,9 @@
 # Determines if things like browser caching should be used
 PRODUCTION_SERVER = False
 
+# Set how many seconds to keep rendered pages that use set_template(..., cache_ttl=PAGE_CACHE_TTL)
+PAGE_CACHE_TTL = 300
+
 # Pick a directory to store the session data
 SESSION_DIR = 'D:/Session'
 
@@ -1,16 +1,22 @@
-import time
 import traceback
 from functools import wraps
-from flask import redirect, request, render_template
+from flask import redirect, request, render_template, Response
 from werkzeug.http import HTTP_STATUS_CODES
 from werkzeug.exceptions import HTTPException
 
 from .common import *
 from .constants import *
+from extensions.html_minify import minify_page
+from extensions.page_cache import PAGE_CACHE
+from extensions.streaming import stream_template
 
 
-def set_template(template, status_code=200):
-    """Set a template with the correct headers."""
+def set_template(template, status_code=200, cache_ttl=None, minify=None, stream=False):
+    """Set a template with the correct headers.
+    Set cache_ttl to keep the rendered page for that many seconds (see extensions.page_cache).
+    The HTML is minified if HTML_MINIFY is set, unless minify says otherwise.
+    Set stream to send the page while it's rendered (see extensions.streaming).
+    """
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):            
@@ -24,11 +30,23 @@ def set_template(template, status_code=200):
                 return result
             
             result['debug'] = {}
-            if not PRODUCTION_SERVER:
-                result['debug']['css_nocache'] = '?random={}'.format(int(time.time()))
-            
+
             #Render the response (request.args is GET, request.form is POST)
-            response = render_template(template, request=request, **result), status_code
-            return set_headers(response)
+            if stream:
+                body = stream_template(template, request=request, **result)
+                return set_headers(Response(body, status_code, mimetype='text/html'))
+
+            def render():
+                return minify_page(render_template(template, request=request, **result), minify)
+
+            cache_key = PAGE_CACHE.key(template, status_code, result) if cache_ttl else None
+            if cache_key is None:
+                body = render()
+            else:
+                body = PAGE_CACHE.get(cache_key)
+                if body is None:
+                    body = render()
+                    PAGE_CACHE.set(cache_key, body, cache_ttl)
+            return set_headers((body, status_code))
         return wrapper
     return decorator
@@ -23,7 +23,7 @@ def test_page(username=None):
 
 
 @app.route('/login', methods=['GET', 'POST'])
-@set_template('login.html')
+@set_template('login.html', cache_ttl=PAGE_CACHE_TTL)
 def login():
     data = {'errors': [], 'warnings': [], 'autofocus': None}
     if request.method == 'POST':
@@ -49,7 +49,7 @@ def login():
 
 
 @app.route('/register', methods=['GET', 'POST'])
-@set_template('register.html')
+@set_template('register.html', cache_ttl=PAGE_CACHE_TTL)
 def register():
     data = {'errors': [], 'autofocus': None}
     if request.method == 'POST':